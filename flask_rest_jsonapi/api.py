@@ -3,7 +3,12 @@
 import inspect
 from functools import wraps
 
+from flask import request
+
 from flask_rest_jsonapi.resource import ResourceList
+from flask_rest_jsonapi.decorators import check_request_headers
+from flask_rest_jsonapi.data_layers.alchemy import close_sessions, set_sticky_cookie
+from flask_rest_jsonapi.links import compile_links
 
 
 class Api(object):
@@ -14,6 +19,11 @@ class Api(object):
         self.resources = []
         self.resource_registry = []
         self.decorators = decorators or tuple()
+        self.endpoints = set()
+
+        if app is not None:
+            self.register_teardown(app)
+            self.register_header_checks(app)
 
     def init_app(self, app=None, blueprint=None):
         """Update flask application with our api
@@ -22,6 +32,8 @@ class Api(object):
         """
         if app is not None:
             self.app = app
+            self.register_teardown(app)
+            self.register_header_checks(app)
 
         if blueprint is not None:
             self.blueprint = blueprint
@@ -35,6 +47,36 @@ class Api(object):
         if self.blueprint is not None:
             self.app.register_blueprint(self.blueprint)
 
+        if self.app is not None:
+            self.compile_links()
+
+    def register_teardown(self, app):
+        """Close the sessions opened by data layers at the end of each application context and send the sticky reads
+        cookie after writes
+
+        :param Application app: a flask application
+        """
+        if close_sessions not in app.teardown_appcontext_funcs:
+            app.teardown_appcontext(close_sessions)
+        if set_sticky_cookie not in app.after_request_funcs.get(None, ()):
+            app.after_request(set_sticky_cookie)
+
+    def register_header_checks(self, app):
+        """Check the headers of the requests to the api before their dispatch to the views
+
+        :param Application app: a flask application
+        """
+        if self.check_headers not in app.before_request_funcs.get(None, ()):
+            app.before_request(self.check_headers)
+
+    def check_headers(self):
+        """Check the headers of a request to an endpoint of the api, rejecting it before the resource is instantiated
+
+        :return Response: the error response if headers are invalid, None otherwise
+        """
+        if request.endpoint in self.endpoints:
+            return check_request_headers()
+
     def route(self, resource, view, *urls, **kwargs):
         """Create an api view.
 
@@ -57,9 +99,11 @@ class Api(object):
             resource.view = '.'.join([self.blueprint.name, resource.view])
             for url in urls:
                 self.blueprint.add_url_rule(url, view_func=view_func, **url_rule_options)
+            self.endpoints.add(resource.view)
         elif self.app is not None:
             for url in urls:
                 self.app.add_url_rule(url, view_func=view_func, **url_rule_options)
+            self.endpoints.add(resource.view)
         else:
             self.resources.append({'resource': resource,
                                    'view': view,
@@ -68,6 +112,17 @@ class Api(object):
 
         self.resource_registry.append(resource)
 
+        if self.blueprint is None and self.app is not None:
+            self.compile_links()
+
+    def compile_links(self):
+        """Compile the link templates of the schemas of the resources registered on the application. Links to
+        endpoints that are not registered yet are compiled on first use.
+        """
+        for resource in self.resource_registry:
+            if getattr(resource, 'schema', None) is not None:
+                compile_links(self.app, resource.schema)
+
     def oauth_manager(self, oauth_manager):
         """Use the oauth manager to enable oauth for API
 
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+import json
+from collections import OrderedDict, defaultdict
+from threading import Lock
+
+from flask import has_request_context, request
+from marshmallow_jsonapi.fields import Relationship
+
+from flask_rest_jsonapi.schema import get_model_field
+
+
+class ResourceCache(object):
+    """LRU cache of serialized resource objects shared between resource managers
+
+    Entries are keyed by resource type, id, version, sparse fieldset, schema class, relationships including resource
+    linkage and by the host and script root of the request the links are built for. Only resource types registered in
+    the cache are cached.
+
+    Without version field, entries are only invalidated by the writes of the data layers using the cache: objects
+    modified by other processes or by other code are served stale until they are evicted.
+    """
+
+    def __init__(self, max_entries=1024, max_memory=None):
+        """Initialize a cache instance
+
+        :param int max_entries: the maximum number of serialized resource objects kept in the cache
+        :param int max_memory: the maximum number of bytes used by serialized resource objects kept in the cache
+        """
+        self.max_entries = max_entries
+        self.max_memory = max_memory
+        self.memory = 0
+        self.entries = OrderedDict()
+        self.index = defaultdict(set)
+        self.version_fields = {}
+        self.lock = Lock()
+
+    def register(self, type_, version_field=None):
+        """Enable the cache for a resource type
+
+        :param str type_: the resource type
+        :param str version_field: the model attribute used as version of the objects
+        """
+        self.version_fields[type_] = version_field
+
+    def key(self, schema, obj):
+        """Compute the cache key of an object serialized with a schema
+
+        :param Schema schema: a marshmallow schema
+        :param obj: the object to serialize
+        :return tuple: the cache key or None if the resource type is not cached
+        """
+        type_ = schema.opts.type_
+        if type_ not in self.version_fields:
+            return None
+
+        version_field = self.version_fields[type_]
+        version = str(getattr(obj, version_field)) if version_field is not None else None
+        fields = tuple(sorted(schema.only)) if schema.only else None
+        linkage = tuple(sorted(name for name, field in schema.fields.items()
+                               if isinstance(field, Relationship) and field.include_resource_linkage))
+        location = (request.host, request.script_root) if has_request_context() else None
+
+        return type_, str(getattr(obj, get_model_field(schema, 'id'))), version, fields, type(schema), linkage, location
+
+    def get(self, key):
+        """Get a serialized resource object
+
+        :param tuple key: the cache key
+        :return dict: the serialized resource object or None
+        """
+        with self.lock:
+            value = self.entries.pop(key, None)
+            if value is None:
+                return None
+            self.entries[key] = value
+
+        return json.loads(value)
+
+    def set(self, key, item):
+        """Store a serialized resource object
+
+        :param tuple key: the cache key
+        :param dict item: the serialized resource object
+        """
+        value = json.dumps(item)
+
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = value
+            self.index[key[:2]].add(key)
+            self.memory += len(value)
+
+            while len(self.entries) > self.max_entries or \
+                    (self.max_memory is not None and self.memory > self.max_memory):
+                self._remove(next(iter(self.entries)))
+
+    def invalidate(self, type_, id_=None):
+        """Remove serialized resource objects of a type or of a single object
+
+        :param str type_: the resource type
+        :param id_: the identifier of the object. If None, all objects of the type are removed
+        """
+        with self.lock:
+            if id_ is None:
+                objects = [object_ for object_ in self.index if object_[0] == type_]
+            else:
+                objects = [(type_, str(id_))]
+
+            for object_ in objects:
+                for key in list(self.index.get(object_, ())):
+                    self._remove(key)
+
+    def clear(self):
+        """Remove all serialized resource objects"""
+        with self.lock:
+            self.entries.clear()
+            self.index.clear()
+            self.memory = 0
+
+    def _remove(self, key):
+        """Remove an entry, the lock must be held by the caller
+
+        :param tuple key: the cache key
+        """
+        value = self.entries.pop(key, None)
+        if value is None:
+            return
+
+        self.memory -= len(value)
+        keys = self.index[key[:2]]
+        keys.discard(key)
+        if not keys:
+            del self.index[key[:2]]
@@ -2,3 +2,12 @@
 
 # default number of items for pagination
 DEFAULT_PAGE_SIZE = 20
+
+# default number of objects written by each statement of bulk operations
+DEFAULT_BATCH_SIZE = 1000
+
+# number of seconds during which reads stick to the write session after a write when a read session is used
+DEFAULT_STICKY_WINDOW = 5
+
+# name of the cookie holding the time until which the reads of a client stick to the write session after its writes
+STICKY_COOKIE = 'jsonapi_sticky_until'
@@ -1,16 +1,107 @@
 # -*- coding: utf-8 -*-
 
-from flask import current_app
+import sqlite3
+import time
+import warnings
+from contextlib import contextmanager
+from datetime import date, time as datetime_time
+from decimal import Decimal
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import and_, or_, event, func, select, text, tuple_, Integer, PrimaryKeyConstraint, UniqueConstraint
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import aliased, with_parent, make_transient_to_detached, scoped_session, sessionmaker
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.orm.collections import InstrumentedList
+from sqlalchemy.orm.interfaces import MANYTOONE, ONETOMANY
 from sqlalchemy.inspection import inspect
-from flask import request
-from flask_rest_jsonapi.constants import DEFAULT_PAGE_SIZE
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression, Grouping, Null, TextClause
+from flask_rest_jsonapi.constants import DEFAULT_PAGE_SIZE, DEFAULT_BATCH_SIZE, DEFAULT_STICKY_WINDOW, STICKY_COOKIE
 from flask_rest_jsonapi.data_layers.base import BaseDataLayer
+from flask_rest_jsonapi.data_layers.metrics import get_pool_metrics
 from flask_rest_jsonapi.exceptions import RelationNotFound, RelatedObjectNotFound, JsonApiException,\
-    InvalidSort, ObjectNotFound
-from flask_rest_jsonapi.data_layers.filtering.alchemy import create_filters
-from flask_rest_jsonapi.schema import get_relationships
+    InvalidSort, InvalidAggregate, ObjectNotFound, PreconditionFailed, QueryTimeout
+from flask_rest_jsonapi.data_layers.filtering.alchemy import create_filters, FullTextRank
+from flask_rest_jsonapi.schema import get_relationships, get_model_field
+
+
+def close_sessions(exception=None):
+    """Close the sessions opened by data layers from session factories and remove the scoped sessions used during the
+    application context. Registered as teardown function of the application by the Api.
+
+    :param Exception exception: the exception raised during the request if any
+    """
+    for source, session in g.pop('jsonapi_sessions', dict()).items():
+        if isinstance(source, scoped_session):
+            source.remove()
+        else:
+            session.close()
+
+
+def set_sticky_cookie(response):
+    """Send the time until which the reads of the client stick to the session used to write data, after a write made
+    by a data layer with a read session during the request. Registered as after request function of the application by
+    the Api.
+
+    :param Response response: the response of the request
+    :return Response: the response
+    """
+    sticky_until = g.get('jsonapi_sticky_until')
+    if sticky_until is not None:
+        response.set_cookie(STICKY_COOKIE, '{:.3f}'.format(sticky_until),
+                            max_age=max(int(sticky_until - time.time()) + 1, 1), httponly=True)
+    return response
+
+
+def is_statement_timeout(exception):
+    """Check if an exception, or the database error it was raised from, is the cancellation of a statement by a
+    statement timeout: SQLSTATE 57014 for PostgreSQL or an interrupted statement for SQLite
+
+    :param Exception exception: the exception
+    :return bool: True if a statement has been cancelled by a statement timeout
+    """
+    while exception is not None:
+        if isinstance(exception, DBAPIError):
+            error = exception.orig
+            if (getattr(error, 'pgcode', None) or getattr(error, 'sqlstate', None)) == '57014':
+                return True
+            return isinstance(error, sqlite3.OperationalError) and str(error) == 'interrupted'
+        exception = getattr(exception, '__cause__', None) or getattr(exception, '__context__', None)
+
+    return False
+
+
+def after_key(columns, values):
+    """Build the condition selecting the rows following a key in the order of its columns, like the row value
+    comparison (column1, column2, ...) > (value1, value2, ...) which is not supported by every database
+
+    :param list columns: the columns of the key
+    :param tuple values: the values of the columns of the key
+    :return: the condition
+    """
+    return or_(*[and_(*[columns[previous] == values[previous] for previous in range(index)] +
+                      [columns[index] > values[index]])
+                 for index in range(len(columns))])
+
+
+def is_not_deleted_predicate(where, deleted_at):
+    """Check that the where clause of a partial index is the "deleted_at IS NULL" predicate of objects that are not
+    soft deleted
+
+    :param where: the where clause of the index, an sql expression or a text clause
+    :param Column deleted_at: the deleted_at column of the table
+    :return bool: True if the where clause is the predicate
+    """
+    while isinstance(where, Grouping):
+        where = where.element
+
+    if isinstance(where, TextClause):
+        return ' '.join(where.text.strip('() ').replace('"', '').lower().split()) == \
+            '{} is null'.format(deleted_at.name.lower())
+
+    return isinstance(where, BinaryExpression) and where.operator is operators.is_ and where.left is deleted_at and \
+        isinstance(where.right, Null)
 
 
 class SqlalchemyDataLayer(BaseDataLayer):
@@ -18,13 +109,90 @@ class SqlalchemyDataLayer(BaseDataLayer):
     def __init__(self, kwargs):
         super(SqlalchemyDataLayer, self).__init__(kwargs)
 
-        if not hasattr(self, 'session'):
+        if not hasattr(self, 'session_source'):
             raise Exception("You must provide a session in data_layer_kwargs to use sqlalchemy data layer in {}"
                             .format(self.resource.__name__))
         if not hasattr(self, 'model'):
             raise Exception("You must provide a model in data_layer_kwargs to use sqlalchemy data layer in {}"
                             .format(self.resource.__name__))
 
+    @property
+    def session(self):
+        """The session used by the data layer during the current request
+
+        :return Session: an sqlalchemy session
+        """
+        return self.open_session(self.session_source)
+
+    @session.setter
+    def session(self, value):
+        self.session_source = value
+
+    @property
+    def read_session(self):
+        """The session used to read data from a read replica during the current request
+
+        :return Session: an sqlalchemy session or None
+        """
+        if getattr(self, 'read_session_source', None) is None:
+            return None
+        return self.open_session(self.read_session_source)
+
+    @read_session.setter
+    def read_session(self, value):
+        self.read_session_source = value
+
+    def open_session(self, source):
+        """Get the session of the current request from a session, a scoped_session or a session factory. Sessions
+        created by a session factory are opened on first use and shared by all data layers during a request. They are
+        closed, and scoped sessions removed, when the application context is torn down (see close_sessions), so
+        session factories can only be used in an application context.
+
+        :param source: a session, a scoped_session or a session factory (sessionmaker)
+        :return Session: an sqlalchemy session
+        """
+        if not isinstance(source, (sessionmaker, scoped_session)):
+            return source
+
+        if not has_app_context():
+            if isinstance(source, scoped_session):
+                return source
+            raise Exception("Sessions of the session factory of {} can only be opened in an application context"
+                            .format(self.resource.__name__))
+
+        sessions = g.setdefault('jsonapi_sessions', dict())
+        if source not in sessions:
+            if isinstance(source, scoped_session):
+                sessions[source] = source
+            else:
+                session = source()
+                pool_metrics = get_pool_metrics(session.get_bind(mapper=inspect(self.model)))
+                start = time.time()
+                session.connection(mapper=inspect(self.model))
+                pool_metrics.record_session(time.time() - start)
+                sessions[source] = session
+
+        return sessions[source]
+
+    def get_pool_metrics(self):
+        """Get the connection pool metrics of the engine used by the data layer
+
+        :return dict: the metrics of the pool
+        """
+        source = self.session_source
+        if isinstance(source, sessionmaker):
+            bind = source.kw.get('bind')
+            if bind is None:
+                session = source()
+                try:
+                    bind = session.get_bind(mapper=inspect(self.model))
+                finally:
+                    session.close()
+        else:
+            bind = source.get_bind(mapper=inspect(self.model))
+
+        return get_pool_metrics(bind).as_dict()
+
     def create_object(self, data, view_kwargs):
         """Create an object through sqlalchemy
 
@@ -40,7 +208,7 @@ class SqlalchemyDataLayer(BaseDataLayer):
 
         self.session.add(obj)
         try:
-            self.session.commit()
+            self.commit_object(obj, data)
         except Exception as e:
             self.session.rollback()
             if current_app.config['PROPOGATE_ERROR'] is True:
@@ -48,6 +216,9 @@ class SqlalchemyDataLayer(BaseDataLayer):
             else:
                 raise JsonApiException({'pointer': '/data'}, "Object creation error")
 
+        self.invalidate_cache(obj, [key for key in data if key in relationship_fields])
+        self.record_write()
+
         self.after_create_object(obj, data, view_kwargs)
 
         return obj
@@ -60,6 +231,33 @@ class SqlalchemyDataLayer(BaseDataLayer):
         """
         self.before_get_object(view_kwargs)
 
+        try:
+            obj = self.get_object_query(view_kwargs, get_trashed=get_trashed).one()
+        except NoResultFound:
+            obj = None
+
+        self.after_get_object(obj, view_kwargs)
+
+        return obj
+
+    def get_last_modified(self, view_kwargs, get_trashed=False):
+        """Retrieve the last modification date of an object without loading the object
+
+        :params dict view_kwargs: kwargs from the resource view
+        :return datetime: the value of the last_modified_field of the object or None if the object doesn't exist
+        """
+        row = self.get_object_query(view_kwargs, get_trashed=get_trashed)\
+                  .with_entities(getattr(self.model, self.last_modified_field))\
+                  .first()
+
+        return row[0] if row is not None else None
+
+    def get_object_query(self, view_kwargs, get_trashed=False):
+        """Construct the query to retrieve an object
+
+        :params dict view_kwargs: kwargs from the resource view
+        :return Query: the query filtered on the identifier of the object
+        """
         id_field = getattr(self, 'id_field', inspect(self.model).primary_key[0].name)
         try:
             filter_field = getattr(self.model, id_field)
@@ -68,47 +266,180 @@ class SqlalchemyDataLayer(BaseDataLayer):
 
         url_field = getattr(self, 'url_field', 'id')
         filter_value = view_kwargs[url_field]
-        try:
-            if 'deleted_at' not in self.resource.schema._declared_fields or get_trashed or current_app.config['SOFT_DELETE'] is False:
-                obj = self.session.query(self.model).filter(filter_field == filter_value).one()
-            else:
-                obj = self.session.query(self.model).filter(filter_field == filter_value).filter_by(deleted_at=None).one()
-        except NoResultFound:
-            obj = None
 
-        self.after_get_object(obj, view_kwargs)
+        return self.get_read_session().query(self.model)\
+                                       .filter(filter_field == filter_value,
+                                               *self.get_soft_delete_filters(get_trashed=get_trashed))
 
-        return obj
+    @staticmethod
+    def get_trashed():
+        """Check if soft deleted objects are requested through the "get_trashed" querystring parameter
+
+        :return bool: True if soft deleted objects are retrieved
+        """
+        return has_request_context() and request.args.get('get_trashed') == 'true'
+
+    def get_soft_delete_filters(self, get_trashed=False):
+        """Get the filters excluding soft deleted objects from queries
+
+        :param bool get_trashed: whether soft deleted objects are retrieved
+        :return list: the filters to apply
+        """
+        if get_trashed or 'deleted_at' not in self.resource.schema._declared_fields \
+                or current_app.config['SOFT_DELETE'] is False:
+            return []
+
+        return [self.get_soft_delete_predicates()[False]]
+
+    def get_soft_delete_predicates(self):
+        """Get the predicates matching soft deleted objects and objects that are not soft deleted. They are built once
+        per data layer and written "deleted_at IS NULL" like the where clause of partial indexes so that the database
+        can use them.
+
+        :return dict: the predicates of soft deleted objects (True) and of objects not soft deleted (False)
+        """
+        if getattr(self, '_soft_delete_predicates', None) is None:
+            self._soft_delete_predicates = {True: self.model.deleted_at.isnot(None),
+                                            False: self.model.deleted_at.is_(None)}
+
+        return self._soft_delete_predicates
+
+    def check_soft_delete_index(self):
+        """Warn if the table of the model has no partial index excluding soft deleted objects. Without such an index,
+        filtering on "deleted_at IS NULL" scans the whole table.
+        """
+        if 'deleted_at' not in inspect(self.model).column_attrs:
+            return
+
+        deleted_at = inspect(self.model).column_attrs['deleted_at'].columns[0]
+        for index in deleted_at.table.indexes:
+            for key, where in index.dialect_kwargs.items():
+                if key.endswith('_where') and where is not None and is_not_deleted_predicate(where, deleted_at):
+                    return
+
+        warnings.warn("{} has no partial index with a \"deleted_at IS NULL\" where clause: queries on soft deleted "
+                      "resources will scan the whole {} table".format(self.model.__name__, deleted_at.table.name))
 
     def get_collection(self, qs, view_kwargs):
-        """Retrieve a collection of objects through sqlalchemy
+        """Retrieve a collection of objects through sqlalchemy. Soft deleted objects are retrieved if the "get_trashed"
+        querystring parameter is set.
 
         :param QueryStringManager qs: a querystring manager to retrieve information from url
         :param dict view_kwargs: kwargs from the resource view
         :return tuple: the number of object and the list of objects
         """
         self.before_get_collection(qs, view_kwargs)
-        if 'deleted_at' not in self.resource.schema._declared_fields or request.args.get('get_trashed') == 'true' or current_app.config['SOFT_DELETE'] is False:
-            query = self.query(view_kwargs)
-        else:
-            query = self.query(view_kwargs).filter(self.model.deleted_at == None)
+
+        query = self.query(view_kwargs).filter(*self.get_soft_delete_filters(get_trashed=self.get_trashed()))
 
         if qs.filters:
             query = self.filter_query(query, qs.filters, self.model)
 
-        if qs.sorting:
-            query = self.sort_query(query, qs.sorting)
+        sort_info = qs.sorting
+        if sort_info:
+            self.check_sorting(sort_info)
+        else:
+            sort_info = getattr(self, 'default_sort', None) or []
 
         object_count = query.count()
 
+        query = self.sort_query(query, sort_info, search=self.get_search_value(qs.filters))
+
         query = self.paginate_query(query, qs.pagination)
 
+        row_columns = self.get_row_columns(qs)
+        if row_columns is not None:
+            query = query.with_entities(*row_columns)
+
         collection = query.all()
 
         self.after_get_collection(collection, qs, view_kwargs)
 
         return object_count, collection
 
+    def get_row_columns(self, qs):
+        """Get the columns selected by get_collection in read only mode. Collections are then retrieved as rows and
+        serialized by the compiled serializer of the resource without loading objects. Only the columns of the fields
+        serialized for the request are selected, according to its sparse fieldset. The read only mode is turned off
+        when the serializer needs objects, for compound documents and when the after_get_collection additional method
+        is used.
+
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        :return list: the columns of the rows or None to retrieve objects
+        """
+        if getattr(self, 'read_only', False) is not True or qs.include:
+            return None
+        if 'after_get_collection' in self.__dict__ or \
+                type(self).after_get_collection is not SqlalchemyDataLayer.after_get_collection:
+            return None
+
+        serializer = getattr(getattr(self, 'resource', None), '_serializer', None)
+        if serializer is None or serializer.compiled is not True:
+            return None
+
+        type_ = serializer.schema.opts.type_
+        attributes = serializer.get_row_attributes(set(qs.fields[type_]) | {'id'} if type_ in qs.fields else None)
+        column_attrs = inspect(self.model).column_attrs
+        if attributes is None or any(attribute not in column_attrs for attribute in attributes):
+            return None
+
+        return [getattr(self.model, attribute).label(attribute) for attribute in sorted(attributes)]
+
+    def get_aggregates(self, qs, view_kwargs):
+        """Compute aggregates of a collection of objects through sqlalchemy without loading the objects. Soft deleted
+        objects are aggregated if the "get_trashed" querystring parameter is set. Groups are paginated like collections.
+
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        :param dict view_kwargs: kwargs from the resource view
+        :return list: the aggregates of each group of objects
+        """
+        query = self.query(view_kwargs).filter(*self.get_soft_delete_filters(get_trashed=self.get_trashed()))
+
+        if qs.filters:
+            query = self.filter_query(query, qs.filters, self.model)
+
+        group_by = qs.group_by
+        aggregates = qs.aggregates or [{'function': 'count', 'field': '*', 'name': '*'}]
+
+        for info in group_by + aggregates:
+            if info['field'] != '*' and info['field'] not in inspect(self.model).column_attrs:
+                raise InvalidAggregate("{} has no attribute {}".format(self.model.__name__, info['field']))
+
+        group_columns = [getattr(self.model, info['field']) for info in group_by]
+        aggregate_columns = [func.count(inspect(self.model).primary_key[0]) if info['field'] == '*'
+                             else getattr(func, info['function'])(getattr(self.model, info['field']))
+                             for info in aggregates]
+
+        query = query.with_entities(*(group_columns + aggregate_columns))
+        if group_columns:
+            query = query.group_by(*group_columns).order_by(*group_columns)
+            query = self.paginate_query(query, qs.pagination)
+
+        results = []
+        for row in query.all():
+            result = dict()
+            if group_by:
+                result['group'] = {info['name']: self.get_aggregate_value(value)
+                                   for info, value in zip(group_by, row[:len(group_by)])}
+            for info, value in zip(aggregates, row[len(group_by):]):
+                result.setdefault(info['function'], dict())[info['name']] = self.get_aggregate_value(value)
+            results.append(result)
+
+        return results
+
+    @staticmethod
+    def get_aggregate_value(value):
+        """Convert a value computed by the database to a json serializable value
+
+        :param value: a value of a row
+        :return: the json serializable value
+        """
+        if isinstance(value, Decimal):
+            return float(value)
+        if isinstance(value, (date, datetime_time)):
+            return value.isoformat()
+        return value
+
     def update_object(self, obj, data, view_kwargs):
         """Update an object through sqlalchemy
 
@@ -126,14 +457,93 @@ class SqlalchemyDataLayer(BaseDataLayer):
         self.before_update_object(obj, data, view_kwargs)
 
         relationship_fields = get_relationships(self.resource.schema)
-        for key, value in data.items():
-            if hasattr(obj, key) and key not in relationship_fields:
-                setattr(obj, key, value)
+        concurrency_field = getattr(self, 'concurrency_field', None)
+        if concurrency_field is not None and data.get(concurrency_field) is not None:
+            self.compare_and_set(obj, data, concurrency_field)
+        else:
+            for key, value in data.items():
+                if hasattr(obj, key) and key not in relationship_fields:
+                    setattr(obj, key, value)
+            if concurrency_field is not None and self.get_version_increment(concurrency_field) is not None:
+                setattr(obj, concurrency_field, self.get_version_increment(concurrency_field))
 
         self.apply_relationships(data, obj)
 
         try:
+            self.commit_object(obj, data)
+        except Exception as e:
+            self.session.rollback()
+            if current_app.config['PROPOGATE_ERROR'] is True:
+                raise JsonApiException({'pointer': '/data'}, "Update object error: " + str(e))
+            else:
+                raise JsonApiException({'pointer': '/data'}, "Update object error")
+
+        self.invalidate_cache(obj, [key for key in data if key in relationship_fields])
+        self.record_write()
+
+        self.after_update_object(obj, data, view_kwargs)
+
+    def update_object_returning(self, data, view_kwargs, get_trashed=False):
+        """Update an object with a single UPDATE ... RETURNING statement instead of loading it before to update it. The
+        object is built from the returned row. Payloads containing relationships or attributes that are not columns
+        of the model, payloads without columns to write, and data layers with a before_update_object additional method,
+        which receives the object, are applied to the loaded object through update_object.
+
+        :param dict data: the data validated by marshmallow
+        :param dict view_kwargs: kwargs from the resource view
+        :param bool get_trashed: whether soft deleted objects can be updated
+        :return DeclarativeMeta: the updated object or None if the object doesn't exist
+        """
+        mapper = inspect(self.model)
+        relationship_fields = get_relationships(self.resource.schema)
+        concurrency_field = getattr(self, 'concurrency_field', None)
+        if len(mapper.tables) > 1 or mapper.polymorphic_on is not None or \
+                any(key in relationship_fields or (hasattr(self.model, key) and key not in mapper.column_attrs)
+                    for key in data) or \
+                not any(key in mapper.column_attrs and key != concurrency_field for key in data) or \
+                'before_update_object' in self.__dict__ or \
+                type(self).before_update_object is not SqlalchemyDataLayer.before_update_object:
+            obj = self.get_object(view_kwargs, get_trashed=get_trashed)
+            if obj is not None:
+                self.update_object(obj, data, view_kwargs)
+            return obj
+
+        values = {mapper.column_attrs[key].columns[0]: value for (key, value) in data.items()
+                  if key in mapper.column_attrs and key != concurrency_field}
+        if concurrency_field is not None and self.get_version_increment(concurrency_field) is not None:
+            values[mapper.column_attrs[concurrency_field].columns[0]] = self.get_version_increment(concurrency_field)
+
+        object_query = self.get_object_query(view_kwargs, get_trashed=get_trashed)
+        whereclause = object_query.whereclause
+        check_version = concurrency_field is not None and data.get(concurrency_field) is not None
+        if check_version is True:
+            whereclause = and_(whereclause, getattr(self.model, concurrency_field) == data[concurrency_field])
+
+        table = mapper.local_table
+        stmt = table.update().where(whereclause).values(values)
+        try:
+            if self.session.get_bind(mapper=mapper).dialect.implicit_returning:
+                row = self.session.execute(stmt.returning(*table.columns), mapper=mapper).first()
+            elif self.session.execute(stmt, mapper=mapper).rowcount > 0:
+                row = self.session.execute(select(table.columns).where(object_query.whereclause), mapper=mapper)\
+                                  .first()
+            else:
+                row = None
+
+            if row is None:
+                conflict = check_version and object_query.with_entities(*mapper.primary_key).first() is not None
+                self.session.rollback()
+                if conflict:
+                    raise PreconditionFailed({'pointer': '/data/attributes/{}'.format(concurrency_field)},
+                                             "{}: {} has been modified since version {}"
+                                             .format(self.model.__name__,
+                                                     view_kwargs[getattr(self, 'url_field', 'id')],
+                                                     data[concurrency_field]))
+                return None
+
             self.session.commit()
+        except JsonApiException:
+            raise
         except Exception as e:
             self.session.rollback()
             if current_app.config['PROPOGATE_ERROR'] is True:
@@ -141,8 +551,15 @@ class SqlalchemyDataLayer(BaseDataLayer):
             else:
                 raise JsonApiException({'pointer': '/data'}, "Update object error")
 
+        obj = self.load_row(row)
+
+        self.invalidate_cache(obj)
+        self.record_write()
+
         self.after_update_object(obj, data, view_kwargs)
 
+        return obj
+
     def delete_object(self, obj, view_kwargs):
         """Delete an object through sqlalchemy
 
@@ -167,8 +584,96 @@ class SqlalchemyDataLayer(BaseDataLayer):
             else:
                 raise JsonApiException('', "Delete object error")
 
+        self.invalidate_cache(obj, get_relationships(self.resource.schema))
+        self.record_write()
+
         self.after_delete_object(obj, view_kwargs)
 
+    def update_collection(self, qs, view_kwargs, values, trashed=None):
+        """Update the objects of a collection matching the filters of the querystring with set-based UPDATE statements
+
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        :param dict view_kwargs: kwargs from the resource view
+        :param dict values: the values of the model attributes to update
+        :param trashed: None to update all objects, True to update only soft deleted objects and False to update only
+                        objects that are not soft deleted
+        :return int: the number of updated objects
+        """
+        return self.write_collection(qs, view_kwargs, trashed,
+                                     lambda query: query.update(values, synchronize_session=False))
+
+    def delete_collection(self, qs, view_kwargs, trashed=None):
+        """Delete the objects of a collection matching the filters of the querystring with set-based DELETE statements
+
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        :param dict view_kwargs: kwargs from the resource view
+        :param trashed: None to delete all objects, True to delete only soft deleted objects and False to delete only
+                        objects that are not soft deleted
+        :return int: the number of deleted objects
+        """
+        return self.write_collection(qs, view_kwargs, trashed,
+                                     lambda query: query.delete(synchronize_session=False))
+
+    def write_collection(self, qs, view_kwargs, trashed, write):
+        """Write the objects of a collection by batches of primary keys. Each batch is committed on its own so that
+        writing a lot of objects doesn't hold locks for a long time.
+
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        :param dict view_kwargs: kwargs from the resource view
+        :param trashed: None to write all objects, True to write only soft deleted objects and False to write only
+                        objects that are not soft deleted
+        :param callable write: a function executing the UPDATE or DELETE statement of a query and returning the
+                               number of written rows
+        :return int: the number of written objects
+        """
+        if trashed is None:
+            trashed_filters = []
+        else:
+            trashed_filters = [self.get_soft_delete_predicates()[trashed]]
+
+        query = self.query(view_kwargs).filter(*trashed_filters)
+        if qs.filters:
+            query = self.filter_query(query, qs.filters, self.model)
+
+        primary_key = inspect(self.model).primary_key
+        batch_size = getattr(self, 'batch_size', DEFAULT_BATCH_SIZE)
+        count = 0
+        last_id = None
+        try:
+            while True:
+                batch_query = query.with_entities(*primary_key).order_by(*primary_key)
+                if last_id is not None:
+                    batch_query = batch_query.filter(after_key(primary_key, last_id))
+                ids = [tuple(row) for row in batch_query.limit(batch_size)]
+
+                if not ids:
+                    break
+
+                if len(primary_key) > 1:
+                    criterion = tuple_(*primary_key).in_(ids)
+                else:
+                    criterion = primary_key[0].in_([id_[0] for id_ in ids])
+
+                count += write(self.session.query(self.model).filter(criterion, *trashed_filters))
+                self.session.commit()
+
+                last_id = ids[-1]
+        except JsonApiException:
+            raise
+        except Exception as e:
+            self.session.rollback()
+            if current_app.config['PROPOGATE_ERROR'] is True:
+                raise JsonApiException({'pointer': ''}, "Write collection error: " + str(e))
+            else:
+                raise JsonApiException({'pointer': ''}, "Write collection error")
+
+        if count > 0:
+            self.record_write()
+            if getattr(self, 'cache', None) is not None:
+                self.cache.invalidate(self.resource.schema.opts.type_)
+
+        return count
+
     def create_relationship(self, json_data, relationship_field, related_id_field, view_kwargs):
         """Create a relationship
 
@@ -223,6 +728,11 @@ class SqlalchemyDataLayer(BaseDataLayer):
                 raise JsonApiException('', "Create relationship error: " + str(e))
             else:
                 raise JsonApiException('', "Create relationship error")
+
+        if updated is True:
+            self.invalidate_cache(obj, [relationship_field])
+            self.record_write()
+
         self.after_create_relationship(obj, updated, json_data, relationship_field, related_id_field, view_kwargs)
 
         return obj, updated
@@ -230,12 +740,30 @@ class SqlalchemyDataLayer(BaseDataLayer):
     def get_relationship(self, relationship_field, related_type_, related_id_field, view_kwargs):
         """Get a relationship
 
+        Resource linkage is computed from the identifiers of related objects only, related objects are not loaded
+        unless the after_get_relationship additional method is used.
+
         :param str relationship_field: the model attribute used for relationship
         :param str related_type_: the related resource type
         :param str related_id_field: the identifier field of the related model
         :param dict view_kwargs: kwargs from the resource view
         :return tuple: the object and related object(s)
         """
+        obj, data, related_count = self.get_relationship_page(relationship_field, related_type_, related_id_field,
+                                                              view_kwargs, None)
+
+        return obj, data
+
+    def get_relationship_page(self, relationship_field, related_type_, related_id_field, view_kwargs, pagination):
+        """Get a relationship with a page of the resource linkage of a to many relationship
+
+        :param str relationship_field: the model attribute used for relationship
+        :param str related_type_: the related resource type
+        :param str related_id_field: the identifier field of the related model
+        :param dict view_kwargs: kwargs from the resource view
+        :param dict pagination: pagination information of the resource linkage or None for the whole linkage
+        :return tuple: the object, the related object(s) of the page and the number of related objects
+        """
         self.before_get_relationship(relationship_field, related_type_, related_id_field, view_kwargs)
 
         obj = self.get_object(view_kwargs)
@@ -249,19 +777,93 @@ class SqlalchemyDataLayer(BaseDataLayer):
         if not hasattr(obj, relationship_field):
             raise RelationNotFound('', "{} has no attribute {}".format(obj.__class__.__name__, relationship_field))
 
-        related_objects = getattr(obj, relationship_field)
+        # the after_get_relationship additional method receives the related objects so they are only loaded for it
+        if getattr(self.after_get_relationship, '__func__', None) is SqlalchemyDataLayer.after_get_relationship:
+            related_count, related_ids = self.get_related_ids(obj, relationship_field, related_id_field, pagination)
+        else:
+            related_count, related_objects = self.get_related_objects(obj, relationship_field, pagination)
+            if related_objects is not None:
+                self.after_get_relationship(obj, related_objects, relationship_field, related_type_, related_id_field,
+                                            view_kwargs)
+            if isinstance(related_objects, list):
+                related_ids = [getattr(obj_, related_id_field) for obj_ in related_objects]
+            else:
+                related_ids = getattr(related_objects, related_id_field, None)
 
-        if related_objects is None:
-            return obj, related_objects
+        if isinstance(related_ids, list):
+            data = [{'type': related_type_, 'id': related_id} for related_id in related_ids]
+        elif related_ids is not None:
+            data = {'type': related_type_, 'id': related_ids}
+        else:
+            data = None
 
-        self.after_get_relationship(obj, related_objects, relationship_field, related_type_, related_id_field,
-                                    view_kwargs)
+        return obj, data, related_count
 
-        if isinstance(related_objects, InstrumentedList):
-            return obj,\
-                [{'type': related_type_, 'id': getattr(obj_, related_id_field)} for obj_ in related_objects]
-        else:
-            return obj, {'type': related_type_, 'id': getattr(related_objects, related_id_field)}
+    def get_related_query(self, obj, relationship_field, entity, pagination=None):
+        """Query a to many relationship, ordered by primary key of the related model
+
+        :param DeclarativeMeta obj: an object from sqlalchemy
+        :param str relationship_field: the model attribute used for relationship
+        :param entity: the related model or the column of the related model to query
+        :param dict pagination: pagination information of the relationship
+        :return tuple: the number of related objects and the list of results
+        """
+        relationship = getattr(obj.__class__, relationship_field).property
+        query = self.get_read_session().query(entity)\
+                                       .filter(with_parent(obj, getattr(obj.__class__, relationship_field)))\
+                                       .order_by(*relationship.mapper.primary_key)
+
+        if pagination is None:
+            results = query.all()
+            return len(results), results
+
+        return query.count(), self.paginate_query(query, pagination).all()
+
+    def get_related_ids(self, obj, relationship_field, related_id_field, pagination=None):
+        """Get the identifiers of related objects without loading them
+
+        :param DeclarativeMeta obj: an object from sqlalchemy
+        :param str relationship_field: the model attribute used for relationship
+        :param str related_id_field: the identifier field of the related model
+        :param dict pagination: pagination information of a to many relationship
+        :return tuple: the number of related objects and the identifier(s) of the related object(s)
+        """
+        relationship = getattr(obj.__class__, relationship_field).property
+        related_id_column = getattr(relationship.mapper.class_, related_id_field)
+
+        if not relationship.uselist:
+            # the identifier of a many to one related object is usually stored in a foreign key of the object itself
+            local_columns = [local_column for local_column, remote_column in relationship.local_remote_pairs
+                             if remote_column is related_id_column.property.columns[0]]
+            if relationship.direction is MANYTOONE and local_columns:
+                related_id = getattr(obj, inspect(obj.__class__).get_property_by_column(local_columns[0]).key)
+            else:
+                row = self.get_read_session().query(related_id_column)\
+                                             .filter(with_parent(obj, getattr(obj.__class__, relationship_field)))\
+                                             .first()
+                related_id = row[0] if row is not None else None
+
+            return int(related_id is not None), related_id
+
+        related_count, rows = self.get_related_query(obj, relationship_field, related_id_column, pagination)
+
+        return related_count, [row[0] for row in rows]
+
+    def get_related_objects(self, obj, relationship_field, pagination=None):
+        """Get related objects
+
+        :param DeclarativeMeta obj: an object from sqlalchemy
+        :param str relationship_field: the model attribute used for relationship
+        :param dict pagination: pagination information of a to many relationship
+        :return tuple: the number of related objects and the related object(s)
+        """
+        relationship = getattr(obj.__class__, relationship_field).property
+
+        if not relationship.uselist:
+            related_object = getattr(obj, relationship_field)
+            return int(related_object is not None), related_object
+
+        return self.get_related_query(obj, relationship_field, relationship.mapper.class_, pagination)
 
     def update_relationship(self, json_data, relationship_field, related_id_field, view_kwargs):
         """Update a relationship
@@ -288,18 +890,16 @@ class SqlalchemyDataLayer(BaseDataLayer):
         related_model = getattr(obj.__class__, relationship_field).property.mapper.class_
 
         updated = False
+        added_ids, removed_ids = set(), []
 
         if isinstance(json_data['data'], list):
-            related_objects = []
+            _, obj_ids = self.get_related_ids(obj, relationship_field, related_id_field)
+            obj_ids = {str(obj_id): obj_id for obj_id in obj_ids}
+            new_obj_ids = {str(obj_['id']) for obj_ in json_data['data']}
 
-            for obj_ in json_data['data']:
-                related_objects.append(self.get_related_object(related_model, related_id_field, obj_))
-
-            obj_ids = {getattr(obj__, related_id_field) for obj__ in getattr(obj, relationship_field)}
-            new_obj_ids = {getattr(related_object, related_id_field) for related_object in related_objects}
-            if obj_ids != new_obj_ids:
-                setattr(obj, relationship_field, related_objects)
-                updated = True
+            added_ids = new_obj_ids - set(obj_ids)
+            removed_ids = [obj_ids[obj_id] for obj_id in set(obj_ids) - new_obj_ids]
+            updated = bool(added_ids or removed_ids)
 
         else:
             related_object = None
@@ -314,13 +914,23 @@ class SqlalchemyDataLayer(BaseDataLayer):
                 updated = True
 
         try:
+            self.add_related_ids(obj, relationship_field, related_id_field, added_ids)
+            self.remove_related_ids(obj, relationship_field, related_id_field, removed_ids)
             self.session.commit()
+        except JsonApiException:
+            self.session.rollback()
+            raise
         except Exception as e:
             self.session.rollback()
             if current_app.config['PROPOGATE_ERROR'] is True:
                 raise JsonApiException('', "Update relationship error: " + str(e))
             else:
                 raise JsonApiException('', "Update relationship error")
+
+        if updated is True:
+            self.invalidate_cache(obj, [relationship_field])
+            self.record_write()
+
         self.after_update_relationship(obj, updated, json_data, relationship_field, related_id_field, view_kwargs)
 
         return obj, updated
@@ -346,24 +956,25 @@ class SqlalchemyDataLayer(BaseDataLayer):
         if not hasattr(obj, relationship_field):
             raise RelationNotFound('', "{} has no attribute {}".format(obj.__class__.__name__, relationship_field))
 
-        related_model = getattr(obj.__class__, relationship_field).property.mapper.class_
-
         updated = False
+        removed_ids = set()
 
         if isinstance(json_data['data'], list):
-            obj_ids = {str(getattr(obj__, related_id_field)) for obj__ in getattr(obj, relationship_field)}
+            _, obj_ids = self.get_related_ids(obj, relationship_field, related_id_field)
+            obj_ids = {str(obj_id): obj_id for obj_id in obj_ids}
 
-            for obj_ in json_data['data']:
-                if obj_['id'] in obj_ids:
-                    getattr(obj,
-                            relationship_field).remove(self.get_related_object(related_model, related_id_field, obj_))
-                    updated = True
+            removed_ids = {obj_ids[str(obj_['id'])] for obj_ in json_data['data'] if str(obj_['id']) in obj_ids}
+            updated = bool(removed_ids)
         else:
             setattr(obj, relationship_field, None)
             updated = True
 
         try:
+            self.remove_related_ids(obj, relationship_field, related_id_field, removed_ids)
             self.session.commit()
+        except JsonApiException:
+            self.session.rollback()
+            raise
         except Exception as e:
             self.session.rollback()
             if current_app.config['PROPOGATE_ERROR'] is True:
@@ -371,10 +982,391 @@ class SqlalchemyDataLayer(BaseDataLayer):
             else:
                 raise JsonApiException('', "Delete relationship error")
 
+        if updated is True:
+            self.invalidate_cache(obj, [relationship_field])
+            self.record_write()
+
         self.after_delete_relationship(obj, updated, json_data, relationship_field, related_id_field, view_kwargs)
 
         return obj, updated
 
+    def add_related_ids(self, obj, relationship_field, related_id_field, related_ids):
+        """Add related objects to a to many relationship with set based statements
+
+        Only association rows or foreign keys of the added objects are written and the related objects loaded in the
+        session are synchronized. Relationships with a delete-orphan cascade are updated through the ORM.
+
+        :param DeclarativeMeta obj: an object from sqlalchemy
+        :param str relationship_field: the model attribute used for relationship
+        :param str related_id_field: the identifier field of the related model
+        :param iterable related_ids: the identifiers of the related objects to add
+        """
+        related_ids = list(related_ids)
+        if not related_ids:
+            return
+
+        relationship = getattr(obj.__class__, relationship_field).property
+        related_model = relationship.mapper.class_
+        related_id_column = getattr(related_model, related_id_field)
+
+        if relationship.secondary is not None:
+            related_columns = [related_column for related_column, _ in relationship.secondary_synchronize_pairs]
+            rows = self.session.query(related_id_column, *related_columns)\
+                               .filter(related_id_column.in_(related_ids))\
+                               .all()
+            self.check_related_ids(related_model, related_id_field, related_ids, [row[0] for row in rows])
+
+            values = {secondary_column.key: getattr(obj, inspect(obj.__class__).get_property_by_column(column).key)
+                      for column, secondary_column in relationship.synchronize_pairs}
+            self.session.execute(relationship.secondary.insert(),
+                                 [dict(values, **{secondary_column.key: row[index + 1]
+                                                  for index, (_, secondary_column)
+                                                  in enumerate(relationship.secondary_synchronize_pairs)})
+                                  for row in rows])
+        elif relationship.direction is ONETOMANY and not relationship.cascade.delete_orphan:
+            rows = self.session.query(related_id_column).filter(related_id_column.in_(related_ids)).all()
+            self.check_related_ids(related_model, related_id_field, related_ids, [row[0] for row in rows])
+
+            values = {inspect(related_model).get_property_by_column(foreign_column).key:
+                      getattr(obj, inspect(obj.__class__).get_property_by_column(column).key)
+                      for column, foreign_column in relationship.synchronize_pairs}
+            self.session.query(related_model)\
+                        .filter(related_id_column.in_(related_ids))\
+                        .update(values, synchronize_session='fetch')
+        else:
+            related_objects = self.session.query(related_model).filter(related_id_column.in_(related_ids)).all()
+            self.check_related_ids(related_model,
+                                   related_id_field,
+                                   related_ids,
+                                   [getattr(related_object, related_id_field) for related_object in related_objects])
+
+            getattr(obj, relationship_field).extend(related_objects)
+            return
+
+        self.session.expire(obj, [relationship_field])
+        self.expire_related_objects(relationship, related_id_field, related_ids)
+
+    def remove_related_ids(self, obj, relationship_field, related_id_field, related_ids):
+        """Remove related objects from a to many relationship with set based statements
+
+        Only association rows or foreign keys of the removed objects are written and the related objects loaded in the
+        session are synchronized. Relationships with a delete-orphan cascade are updated through the ORM.
+
+        :param DeclarativeMeta obj: an object from sqlalchemy
+        :param str relationship_field: the model attribute used for relationship
+        :param str related_id_field: the identifier field of the related model
+        :param iterable related_ids: the identifiers of the related objects to remove
+        """
+        related_ids = list(related_ids)
+        if not related_ids:
+            return
+
+        relationship = getattr(obj.__class__, relationship_field).property
+        related_model = relationship.mapper.class_
+        related_id_column = getattr(related_model, related_id_field)
+
+        if relationship.secondary is not None:
+            criteria = [secondary_column == getattr(obj, inspect(obj.__class__).get_property_by_column(column).key)
+                        for column, secondary_column in relationship.synchronize_pairs]
+            for related_column, secondary_column in relationship.secondary_synchronize_pairs:
+                if related_column is related_id_column.property.columns[0]:
+                    criteria.append(secondary_column.in_(related_ids))
+                else:
+                    criteria.append(secondary_column.in_(select([related_column])
+                                                         .where(related_id_column.in_(related_ids))))
+            self.session.execute(relationship.secondary.delete().where(and_(*criteria)))
+        elif relationship.direction is ONETOMANY and not relationship.cascade.delete_orphan:
+            criteria = [related_id_column.in_(related_ids)]
+            values = {}
+            for column, foreign_column in relationship.synchronize_pairs:
+                foreign_field = inspect(related_model).get_property_by_column(foreign_column).key
+                criteria.append(getattr(related_model, foreign_field) ==
+                                getattr(obj, inspect(obj.__class__).get_property_by_column(column).key))
+                values[foreign_field] = None
+            self.session.query(related_model).filter(*criteria).update(values, synchronize_session='fetch')
+        else:
+            related_ids = {str(related_id) for related_id in related_ids}
+            related_objects = getattr(obj, relationship_field)
+            for related_object in [related_object for related_object in related_objects
+                                   if str(getattr(related_object, related_id_field)) in related_ids]:
+                related_objects.remove(related_object)
+            return
+
+        self.session.expire(obj, [relationship_field])
+        self.expire_related_objects(relationship, related_id_field, related_ids)
+
+    def expire_related_objects(self, relationship, related_id_field, related_ids):
+        """Expire the reverse relationship of the related objects loaded in the session after set based statements
+        wrote their association rows or foreign keys
+
+        :param RelationshipProperty relationship: the relationship of the object
+        :param str related_id_field: the identifier field of the related model
+        :param iterable related_ids: the identifiers of the written related objects
+        """
+        reverse_fields = [reverse_property.key for reverse_property in relationship._reverse_property]
+        if not reverse_fields:
+            return
+
+        related_ids = {str(related_id) for related_id in related_ids}
+        for related_object in list(self.session.identity_map.values()):
+            if isinstance(related_object, relationship.mapper.class_) and \
+                    str(inspect(related_object).dict.get(related_id_field)) in related_ids:
+                self.session.expire(related_object, reverse_fields)
+
+    def check_related_ids(self, related_model, related_id_field, related_ids, found_ids):
+        """Check that all related objects have been found
+
+        :param Model related_model: an sqlalchemy model
+        :param str related_id_field: the identifier field of the related model
+        :param list related_ids: the identifiers of the related objects
+        :param list found_ids: the identifiers of the related objects found
+        """
+        found_ids = {str(found_id) for found_id in found_ids}
+        for related_id in related_ids:
+            if str(related_id) not in found_ids:
+                raise RelatedObjectNotFound('', "{}.{}: {} not found".format(related_model.__name__,
+                                                                             related_id_field,
+                                                                             related_id))
+
+    def compare_and_set(self, obj, data, concurrency_field):
+        """Update the attributes of an object with a single UPDATE statement conditioned by the version of the object
+        provided by the client. The statement fails to match any row if the object has been updated since the client
+        read it.
+
+        :param DeclarativeMeta obj: an object from sqlalchemy
+        :param dict data: the data validated by marshmallow
+        :param str concurrency_field: the model attribute used as version of the objects for concurrency control
+        """
+        relationship_fields = get_relationships(self.resource.schema)
+        values = {key: value for (key, value) in data.items()
+                  if hasattr(obj, key) and key not in relationship_fields and key != concurrency_field}
+        if self.get_version_increment(concurrency_field) is not None:
+            values[concurrency_field] = self.get_version_increment(concurrency_field)
+
+        mapper = inspect(self.model)
+        filters = [column == value for (column, value) in zip(mapper.primary_key, inspect(obj).identity)]
+        filters.append(getattr(self.model, concurrency_field) == data[concurrency_field])
+        query = self.session.query(self.model).filter(*filters)
+
+        try:
+            if values:
+                updated = query.update(values, synchronize_session='evaluate')
+            else:
+                # nothing to write, the version is only checked
+                updated = query.with_entities(*mapper.primary_key).count()
+        except Exception as e:
+            self.session.rollback()
+            if current_app.config['PROPOGATE_ERROR'] is True:
+                raise JsonApiException({'pointer': '/data'}, "Update object error: " + str(e))
+            else:
+                raise JsonApiException({'pointer': '/data'}, "Update object error")
+
+        if updated == 0:
+            self.session.rollback()
+            raise PreconditionFailed({'pointer': '/data/attributes/{}'.format(concurrency_field)},
+                                     "{}: {} has been modified since version {}".format(self.model.__name__,
+                                                                                        inspect(obj).identity[0],
+                                                                                        data[concurrency_field]))
+
+        if concurrency_field not in values:
+            self.session.expire(obj, [concurrency_field])
+
+    def commit_object(self, obj, keys):
+        """Commit the session and restore the column attributes of an object loaded in the session, so that serializing
+        the object after the commit doesn't query the database again. The attributes of the written relationships and
+        the column attributes of their related objects are restored too. Attributes that the flush expired because the
+        database generates their value, like server side defaults or columns updated by a trigger declared with
+        server_onupdate, are not restored and are loaded on access. Columns omitted from the INSERT of a new object
+        that have no default are restored as None.
+
+        :param DeclarativeMeta obj: an object from sqlalchemy
+        :param iterable keys: the model attributes written by the request
+        """
+        inserted = set(self.session.new)
+        self.session.flush()
+
+        def committed_values(object_):
+            state = inspect(object_)
+            values = dict()
+            for column_property in state.mapper.column_attrs:
+                key = column_property.key
+                if key in state.dict:
+                    values[key] = state.dict[key]
+                elif object_ in inserted and key not in state.expired_attributes and \
+                        all(column.default is None and column.server_default is None
+                            for column in column_property.columns):
+                    values[key] = None
+            return values
+
+        loaded_states = [(obj, committed_values(obj))]
+        for relationship_property in inspect(obj).mapper.relationships:
+            if relationship_property.key not in keys or relationship_property.key not in inspect(obj).dict:
+                continue
+            value = inspect(obj).dict[relationship_property.key]
+            loaded_states[0][1][relationship_property.key] = value
+            if value is not None:
+                loaded_states.extend((object_, committed_values(object_))
+                                     for object_ in (value if relationship_property.uselist else [value]))
+
+        self.session.commit()
+
+        for object_, loaded_state in loaded_states:
+            for key, value in loaded_state.items():
+                set_committed_value(object_, key, value)
+
+    def load_row(self, row):
+        """Get the persistent object of a row of the table of the model without querying the database
+
+        :param row: a row containing all the columns of the table of the model
+        :return DeclarativeMeta: an object from sqlalchemy attached to the session
+        """
+        mapper = inspect(self.model)
+        obj = self.session.identity_map.get(mapper.identity_key_from_row(row))
+        if obj is None:
+            obj = mapper.class_manager.new_instance()
+            for prop in mapper.column_attrs:
+                set_committed_value(obj, prop.key, row[prop.columns[0]])
+            make_transient_to_detached(obj)
+            self.session.add(obj)
+        else:
+            for prop in mapper.column_attrs:
+                set_committed_value(obj, prop.key, row[prop.columns[0]])
+
+        return obj
+
+    def get_version_increment(self, concurrency_field):
+        """Get the expression used to increment the version of an object on update
+
+        :param str concurrency_field: the model attribute used as version of the objects
+        :return: the increment expression for an integer version column not managed by the mapper or None. Other
+                 version columns are expected to be updated by an onupdate default or by the mapper itself.
+        """
+        column = inspect(self.model).column_attrs[concurrency_field].columns[0]
+        if not isinstance(column.type, Integer) or inspect(self.model).version_id_col is column:
+            return None
+
+        return getattr(self.model, concurrency_field) + 1
+
+    def get_read_session(self):
+        """Get the session used to read data. Read requests are routed to the read session if there is one, unless the
+        client has written data during the sticky window or the replica lags too much. Other requests
+        read data from the session used to write data.
+
+        :return Session: an sqlalchemy session
+        """
+        if getattr(self, 'read_session_source', None) is None or not has_request_context() \
+                or request.method not in ('GET', 'HEAD'):
+            return self.session
+
+        if time.time() < self.get_sticky_until():
+            return self.session
+
+        read_session = self.read_session
+        if getattr(self, 'replica_lag', None) is not None \
+                and self.replica_lag(read_session) > getattr(self, 'max_replica_lag', 0):
+            return self.session
+
+        return read_session
+
+    @staticmethod
+    def get_sticky_until():
+        """Get the time until which the reads of the client stick to the session used to write data, from the writes
+        made during the request or the cookie sent by the client after its last write
+
+        :return float: the timestamp or 0
+        """
+        try:
+            sticky_until = float(request.cookies.get(STICKY_COOKIE, 0))
+        except ValueError:
+            sticky_until = 0
+
+        return max(g.get('jsonapi_sticky_until', 0), sticky_until)
+
+    def record_write(self):
+        """Record a write of the client, so that its reads stick to the session used to write data during the sticky
+        window. The time until which reads stick is sent to the client in a cookie by set_sticky_cookie.
+        """
+        if getattr(self, 'read_session_source', None) is None or not has_request_context():
+            return
+
+        sticky_until = time.time() + getattr(self, 'sticky_window', DEFAULT_STICKY_WINDOW)
+        g.jsonapi_sticky_until = max(g.get('jsonapi_sticky_until', 0), sticky_until)
+
+    def invalidate_cache(self, obj, relationship_fields=None):
+        """Remove the serialized versions of an object from the cache after a commit
+
+        :param DeclarativeMeta obj: an object from sqlalchemy
+        :param iterable relationship_fields: the model attributes used for relationships that have changed. Serialized
+                                             objects of the related resource types are removed too because their
+                                             resource linkage may have changed
+        """
+        if getattr(self, 'cache', None) is None:
+            return
+
+        schema = self.resource.schema
+        self.cache.invalidate(schema.opts.type_, getattr(obj, get_model_field(schema, 'id')))
+
+        relationships = get_relationships(schema)
+        for relationship_field in relationship_fields or ():
+            self.cache.invalidate(schema._declared_fields[relationships[relationship_field]].type_)
+
+    @contextmanager
+    def statement_timeout_context(self, method):
+        """Limit the time spent by the database to execute the statements of a request. PostgreSQL cancels statements
+        with the statement_timeout setting of each transaction and SQLite interrupts them with a progress handler.
+        Errors are reported as query timeouts when the database error, raised as is or wrapped by the data layer, is
+        the cancellation of a statement (see is_statement_timeout).
+
+        :param str method: the HTTP method of the request
+        """
+        timeout = getattr(self, 'statement_timeout', None)
+        if isinstance(timeout, dict):
+            timeout = timeout.get(method)
+        if timeout is None:
+            yield
+            return
+
+        deadline = time.time() + timeout
+        sessions = []
+        for session in (self.session, self.get_read_session()):
+            session = session() if isinstance(session, scoped_session) else session
+            if session not in sessions:
+                sessions.append(session)
+        connections = []
+        dbapi_connections = []
+
+        def apply_statement_timeout(session_, transaction, connection):
+            connections.append(connection)
+            if connection.dialect.name == 'postgresql':
+                connection.execute(text("SET LOCAL statement_timeout = {:d}"
+                                        .format(max(int((deadline - time.time()) * 1000), 1))))
+            elif connection.dialect.name == 'sqlite':
+                dbapi_connection = connection.connection.connection
+                dbapi_connection.set_progress_handler(lambda: int(time.time() > deadline), 1000)
+                dbapi_connections.append(dbapi_connection)
+
+        try:
+            for session in sessions:
+                event.listen(session, 'after_begin', apply_statement_timeout)
+                applied_connections = len(connections)
+                connection = session.connection(mapper=inspect(self.model))
+                if len(connections) == applied_connections:
+                    apply_statement_timeout(session, None, connection)
+            yield
+        except (DBAPIError, JsonApiException) as e:
+            if not is_statement_timeout(e):
+                raise
+            for session in sessions:
+                session.rollback()
+            raise QueryTimeout({'pointer': ''}, "The request exceeded the statement timeout of {} seconds"
+                               .format(timeout))
+        finally:
+            for session in sessions:
+                if event.contains(session, 'after_begin', apply_statement_timeout):
+                    event.remove(session, 'after_begin', apply_statement_timeout)
+            for dbapi_connection in dbapi_connections:
+                dbapi_connection.set_progress_handler(None, 0)
+
     def get_related_object(self, related_model, related_id_field, obj):
         """Get a related object
 
@@ -438,19 +1430,166 @@ class SqlalchemyDataLayer(BaseDataLayer):
 
         return query
 
-    def sort_query(self, query, sort_info):
-        """Sort query according to jsonapi 1.0
+    def sort_query(self, query, sort_info, search=None):
+        """Sort query according to jsonapi 1.0. The primary key of the model is appended as last sort criterion, in the
+        direction of the last sort field, so that the order of the objects is deterministic across pages
+
         :param Query query: sqlalchemy query to sort
         :param list sort_info: sort information
+        :param str search: the text of the full text search filter, used to sort on relevance
         :return Query: the sorted query
         """
+        joined_paths = dict()
+        sorted_columns = list()
         for sort_opt in sort_info:
             field = sort_opt['field']
-            if not hasattr(self.model, field):
-                raise InvalidSort("{} has no attribute {}".format(self.model.__name__, field))
-            query = query.order_by(getattr(getattr(self.model, field), sort_opt['order'])())
+            if field == 'relevance' and field not in inspect(self.model).column_attrs:
+                if getattr(self, 'search', None) is None or search is None:
+                    raise InvalidSort("You can't sort on relevance without full text search filter")
+                query = query.order_by(getattr(FullTextRank(self.model, self.search, search), sort_opt['order'])())
+                continue
+
+            entity = self.model
+            relationship_path = field.split('.')
+            attribute = relationship_path.pop()
+            for index, relationship_field in enumerate(relationship_path):
+                path = tuple(relationship_path[:index + 1])
+                if path not in joined_paths:
+                    relationship = self.get_sort_relationship(entity, relationship_field, field)
+                    joined_paths[path] = aliased(relationship.mapper.class_)
+                    query = query.outerjoin(joined_paths[path], getattr(entity, relationship_field))
+                entity = joined_paths[path]
+
+            if attribute not in inspect(entity).mapper.column_attrs:
+                raise InvalidSort("{} has no attribute {}".format(inspect(entity).mapper.class_.__name__, attribute))
+            query = query.order_by(getattr(getattr(entity, attribute), sort_opt['order'])())
+            if not relationship_path:
+                sorted_columns.extend(inspect(self.model).column_attrs[attribute].columns)
+
+        order = sort_info[-1]['order'] if sort_info else 'asc'
+        for column in inspect(self.model).primary_key:
+            if not any(column is sorted_column for sorted_column in sorted_columns):
+                query = query.order_by(getattr(column, order)())
         return query
 
+    def check_sorting(self, sort_info):
+        """Check that the fields of sort information are sortable fields of the data layer
+
+        :param list sort_info: sort information
+        """
+        sortable_fields = getattr(self, 'sortable_fields', None)
+        if sortable_fields is None:
+            return
+
+        for sort_opt in sort_info:
+            if sort_opt['field'] == 'relevance' and getattr(self, 'search', None) is not None:
+                continue
+            if sort_opt['field'] not in sortable_fields:
+                raise InvalidSort("You can't sort on {}, sortable fields are: {}"
+                                  .format(sort_opt['field'], ', '.join(sortable_fields)))
+
+    def get_sort_relationship(self, entity, relationship_field, field):
+        """Get the to one relationship of an entity used in a dotted sort path
+
+        :param entity: a model or an alias of a model
+        :param str relationship_field: the name of the relationship in the model
+        :param str field: the whole sort path, used in error messages
+        :return RelationshipProperty: the relationship
+        """
+        mapper = inspect(entity).mapper
+        if relationship_field not in mapper.relationships:
+            raise InvalidSort("{} has no relationship {}".format(mapper.class_.__name__, relationship_field))
+        relationship = mapper.relationships[relationship_field]
+        if relationship.uselist is True:
+            raise InvalidSort("You can't sort on {} because {} is a to many relationship"
+                              .format(field, relationship_field))
+        return relationship
+
+    @staticmethod
+    def get_search_value(filter_info):
+        """Get the text of the full text search filter applied to all objects of a collection
+
+        :param list filter_info: filter information
+        :return str: the searched text or None if there is no full text search filter
+        """
+        for filter_ in filter_info or []:
+            if filter_.get('op') == 'search':
+                return filter_.get('val')
+            if 'and' in filter_:
+                value = SqlalchemyDataLayer.get_search_value(filter_['and'])
+                if value is not None:
+                    return value
+
+        return None
+
+    def check_sortable_fields(self):
+        """Check the sortable fields of the data layer against the indexes of the model. A sortable field that doesn't
+        exist raises an exception, a sortable field that is not the leading column of an index of its table emits a
+        warning because sorting on it needs a full sort of the table.
+        """
+        for field in getattr(self, 'sortable_fields', None) or []:
+            column = self.get_sort_column(field)
+            table = getattr(column, 'table', None)
+            if table is None:
+                continue
+            if not any(columns[0] is column for columns in self.get_index_columns(table)):
+                warnings.warn("{} is sortable but {}.{} is not the leading column of an index: sorting on it will "
+                              "sort the whole {} table".format(field, table.name, column.name, table.name))
+
+    def check_default_sort(self):
+        """Check that the default sort of the data layer, followed by the primary key used as tie-breaker, matches the
+        leading columns of an index of the model. A default sort that doesn't match an index emits a warning because
+        every page of the collection needs a full sort of the table.
+        """
+        default_sort = getattr(self, 'default_sort', None) or []
+        columns = [self.get_sort_column(sort_opt['field']) for sort_opt in default_sort]
+        if any('.' in sort_opt['field'] for sort_opt in default_sort):
+            return
+        columns.extend(column for column in inspect(self.model).primary_key
+                       if not any(column is sorted_column for sorted_column in columns))
+
+        table = columns[0].table
+        for index_columns in self.get_index_columns(table):
+            if len(index_columns) >= len(columns) and \
+                    all(index_column is column for index_column, column in zip(index_columns, columns)):
+                return
+
+        warnings.warn("{} has no index on ({}): the default sort of {} will sort the whole {} table"
+                      .format(table.name, ', '.join(column.name for column in columns), self.model.__name__,
+                              table.name))
+
+    def get_sort_column(self, field):
+        """Get the column of a sort field of the data layer
+
+        :param str field: the dotted path of the sort field in the model
+        :return Column: the column
+        """
+        mapper = inspect(self.model)
+        relationship_path = field.split('.')
+        attribute = relationship_path.pop()
+        for relationship_field in relationship_path:
+            if relationship_field not in mapper.relationships or mapper.relationships[relationship_field].uselist:
+                raise Exception("{} is not a to one relationship of {}, {} is not sortable"
+                                .format(relationship_field, mapper.class_.__name__, field))
+            mapper = mapper.relationships[relationship_field].mapper
+        if attribute not in mapper.column_attrs:
+            raise Exception("{} has no attribute {}, {} is not sortable"
+                            .format(mapper.class_.__name__, attribute, field))
+
+        return mapper.column_attrs[attribute].columns[0]
+
+    @staticmethod
+    def get_index_columns(table):
+        """Get the columns of the indexes, primary key and unique constraints of a table
+
+        :param Table table: an sqlalchemy table
+        :return list: a list of lists of columns
+        """
+        index_columns = [list(index.columns) for index in table.indexes]
+        index_columns.extend(list(constraint.columns) for constraint in table.constraints
+                             if isinstance(constraint, (PrimaryKeyConstraint, UniqueConstraint)))
+        return [columns for columns in index_columns if columns]
+
     def paginate_query(self, query, paginate_info):
         """Paginate query according to jsonapi 1.0
 
@@ -473,7 +1612,7 @@ class SqlalchemyDataLayer(BaseDataLayer):
 
         :param dict view_kwargs: kwargs from the resource view
         """
-        return self.session.query(self.model)
+        return self.get_read_session().query(self.model)
 
     def before_create_object(self, data, view_kwargs):
         """Provide additional data before object creation
@@ -2,6 +2,8 @@
 
 import types
 
+from flask_rest_jsonapi.constants import DEFAULT_PAGE_SIZE
+
 
 class BaseDataLayer(object):
 
@@ -56,6 +58,14 @@ class BaseDataLayer(object):
         """
         raise NotImplementedError
 
+    def get_last_modified(self, view_kwargs, get_trashed=False):
+        """Retrieve the last modification date of an object without loading the object
+
+        :params dict view_kwargs: kwargs from the resource view
+        :return datetime: the last modification date of the object or None if the object doesn't exist
+        """
+        raise NotImplementedError
+
     def get_collection(self, qs, view_kwargs):
         """Retrieve a collection of objects
 
@@ -65,6 +75,15 @@ class BaseDataLayer(object):
         """
         raise NotImplementedError
 
+    def get_aggregates(self, qs, view_kwargs):
+        """Compute aggregates of a collection of objects
+
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        :param dict view_kwargs: kwargs from the resource view
+        :return list: the aggregates of each group of objects
+        """
+        raise NotImplementedError
+
     def update_object(self, obj, data, view_kwargs):
         """Update an object
 
@@ -75,6 +94,16 @@ class BaseDataLayer(object):
         """
         raise NotImplementedError
 
+    def update_object_returning(self, data, view_kwargs, get_trashed=False):
+        """Update an object without loading it first
+
+        :param dict data: the data validated by marshmallow
+        :param dict view_kwargs: kwargs from the resource view
+        :param bool get_trashed: whether soft deleted objects can be updated
+        :return DeclarativeMeta: the updated object or None if the object doesn't exist
+        """
+        raise NotImplementedError
+
     def delete_object(self, obj, view_kwargs):
         """Delete an item through the data layer
 
@@ -83,6 +112,29 @@ class BaseDataLayer(object):
         """
         raise NotImplementedError
 
+    def update_collection(self, qs, view_kwargs, values, trashed=None):
+        """Update the objects of a collection matching the filters of the querystring
+
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        :param dict view_kwargs: kwargs from the resource view
+        :param dict values: the values of the attributes to update
+        :param trashed: None to update all objects, True to update only soft deleted objects and False to update only
+                        objects that are not soft deleted
+        :return int: the number of updated objects
+        """
+        raise NotImplementedError
+
+    def delete_collection(self, qs, view_kwargs, trashed=None):
+        """Delete the objects of a collection matching the filters of the querystring
+
+        :param QueryStringManager qs: a querystring manager to retrieve information from url
+        :param dict view_kwargs: kwargs from the resource view
+        :param trashed: None to delete all objects, True to delete only soft deleted objects and False to delete only
+                        objects that are not soft deleted
+        :return int: the number of deleted objects
+        """
+        raise NotImplementedError
+
     def create_relationship(self, json_data, relationship_field, related_id_field, view_kwargs):
         """Create a relationship
 
@@ -105,6 +157,29 @@ class BaseDataLayer(object):
         """
         raise NotImplementedError
 
+    def get_relationship_page(self, relationship_field, related_type_, related_id_field, view_kwargs, pagination):
+        """Get information about a relationship with a page of the resource linkage of a to many relationship. The
+        default implementation slices the resource linkage returned by get_relationship.
+
+        :param str relationship_field: the model attribute used for relationship
+        :param str related_type_: the related resource type
+        :param str related_id_field: the identifier field of the related model
+        :param dict view_kwargs: kwargs from the resource view
+        :param dict pagination: pagination information of the resource linkage
+        :return tuple: the object, the related object(s) of the page and the number of related objects
+        """
+        obj, data = self.get_relationship(relationship_field, related_type_, related_id_field, view_kwargs)
+        if not isinstance(data, list):
+            return obj, data, int(data is not None)
+
+        related_count = len(data)
+        if int(pagination.get('size', 1)) != 0:
+            page_size = int(pagination.get('size', 0)) or DEFAULT_PAGE_SIZE
+            offset = (int(pagination.get('number', 0) or 1) - 1) * page_size
+            data = data[offset:offset + page_size]
+
+        return obj, data, related_count
+
     def update_relationship(self, json_data, relationship_field, related_id_field, view_kwargs):
         """Update a relationship
 
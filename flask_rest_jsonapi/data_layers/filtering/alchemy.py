@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 
-from sqlalchemy import and_, or_, not_
+from six import string_types
+from sqlalchemy import and_, or_, not_, column, func, literal, literal_column, select, table, Float, String
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.inspection import inspect
+from sqlalchemy.sql.expression import ColumnElement
 
 from flask import current_app
 from flask_rest_jsonapi.exceptions import InvalidFilters
@@ -30,6 +34,9 @@ class Node(object):
         self.schema = schema
 
     def resolve(self):
+        if self.filter_.get('op') == 'search':
+            return FullTextSearch(self.model, self.search_config, self.search_value)
+
         if 'or' not in self.filter_ and 'and' not in self.filter_ and 'not' not in self.filter_:
             value = self.value
 
@@ -134,6 +141,32 @@ class Node(object):
 
             return self.filter_['val']
 
+    @property
+    def search_value(self):
+        """Get the text of a full text search
+
+        :return str: the searched text
+        """
+        value = self.value
+        if not isinstance(value, string_types) or not value.strip():
+            raise InvalidFilters("The value of a search filter must be a non empty string")
+
+        return value
+
+    @property
+    def search_config(self):
+        """Get the full text search configuration of the resource
+
+        :return dict: the full text search configuration
+        """
+        data_layer = getattr(self.resource, '_data_layer', None)
+        config = getattr(data_layer, 'search', None)
+
+        if config is None or getattr(data_layer, 'model', None) is not self.model:
+            raise InvalidFilters("{} has no full text search".format(self.model.__name__))
+
+        return config
+
     @property
     def related_model(self):
         """Get the related model of a relationship field
@@ -161,3 +194,120 @@ class Node(object):
             raise InvalidFilters("{} has no relationship attribute {}".format(self.schema.__name__, relationship_field))
 
         return self.schema._declared_fields[relationship_field].schema.__class__
+
+
+class FullTextSearch(ColumnElement):
+    """Full text search condition on the searchable fields of a model, compiled to the full text search facility of
+    the database: a tsvector match on PostgreSQL, MATCH ... AGAINST on MySQL and a query of an FTS5 table on SQLite.
+    Other databases fall back to a case insensitive LIKE on each field.
+    """
+
+    def __init__(self, model, config, value):
+        """Initialize a full text search condition
+
+        :param DeclarativeMeta model: the model to search
+        :param dict config: the full text search configuration of the resource
+        :param str value: the searched text
+        """
+        self.model = model
+        self.config = config
+        self.value = value
+
+    @property
+    def fields(self):
+        return [getattr(self.model, field) for field in self.config['fields']]
+
+
+class FullTextRank(FullTextSearch):
+    """Relevance of the objects matching a full text search, greater for more relevant objects
+    """
+
+    type = Float()
+
+
+def get_tsvector(element):
+    """Get the tsvector of a PostgreSQL full text search: the "vector" column of the configuration if any, else the
+    concatenation of the searchable fields
+
+    :param FullTextSearch element: a full text search
+    :return ColumnElement: the tsvector
+    """
+    if element.config.get('vector') is not None:
+        return getattr(element.model, element.config['vector'])
+
+    empty, space = literal_column("''", String), literal_column("' '", String)
+    document = func.coalesce(element.fields[0], empty)
+    for field in element.fields[1:]:
+        document = document.concat(space).concat(func.coalesce(field, empty))
+    return func.to_tsvector(literal_column("'{}'".format(element.config.get('language', 'english'))), document)
+
+
+def get_tsquery(element):
+    return func.plainto_tsquery(literal_column("'{}'".format(element.config.get('language', 'english'))),
+                                literal(element.value, String))
+
+
+def get_fts_match(element):
+    """Get the match condition of an SQLite FTS5 table. Each word of the searched text is quoted so that the text is
+    not parsed as a query of the FTS5 query syntax
+
+    :param FullTextSearch element: a full text search
+    :return tuple: the FTS5 table and the match condition
+    """
+    fts_table = table(element.config.get('fts_table', '{}_fts'.format(inspect(element.model).local_table.name)),
+                      column('rowid'), column('rank'))
+    query = ' '.join('"{}"'.format(word.replace('"', '""')) for word in element.value.split())
+    return fts_table, literal_column(fts_table.name).op('MATCH')(literal(query, String))
+
+
+def get_mysql_match(element, compiler, **kw):
+    return "MATCH ({}) AGAINST ({} IN NATURAL LANGUAGE MODE)".format(
+        ', '.join(compiler.process(field, **kw) for field in element.fields),
+        compiler.process(literal(element.value, String), **kw))
+
+
+@compiles(FullTextSearch)
+def compile_search(element, compiler, **kw):
+    value = element.value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    condition = or_(*[field.ilike('%{}%'.format(value), escape='\\') for field in element.fields]).self_group()
+    return compiler.process(condition, **kw)
+
+
+@compiles(FullTextSearch, 'postgresql')
+def compile_search_postgresql(element, compiler, **kw):
+    return compiler.process(get_tsvector(element).op('@@')(get_tsquery(element)), **kw)
+
+
+@compiles(FullTextSearch, 'mysql')
+def compile_search_mysql(element, compiler, **kw):
+    return get_mysql_match(element, compiler, **kw)
+
+
+@compiles(FullTextSearch, 'sqlite')
+def compile_search_sqlite(element, compiler, **kw):
+    fts_table, match = get_fts_match(element)
+    primary_key = inspect(element.model).primary_key[0]
+    return compiler.process(primary_key.in_(select([fts_table.c.rowid]).where(match)), **kw)
+
+
+@compiles(FullTextRank)
+def compile_rank(element, compiler, **kw):
+    return compiler.process(literal_column('0'), **kw)
+
+
+@compiles(FullTextRank, 'postgresql')
+def compile_rank_postgresql(element, compiler, **kw):
+    return compiler.process(func.ts_rank(get_tsvector(element), get_tsquery(element)), **kw)
+
+
+@compiles(FullTextRank, 'mysql')
+def compile_rank_mysql(element, compiler, **kw):
+    return get_mysql_match(element, compiler, **kw)
+
+
+@compiles(FullTextRank, 'sqlite')
+def compile_rank_sqlite(element, compiler, **kw):
+    fts_table, match = get_fts_match(element)
+    primary_key = inspect(element.model).primary_key[0]
+    rank = select([fts_table.c.rank]).where(match).where(fts_table.c.rowid == primary_key).as_scalar()
+    return compiler.process(-rank, **kw)
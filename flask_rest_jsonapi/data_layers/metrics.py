@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+from threading import Lock
+from weakref import ref, WeakKeyDictionary
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+
+class PoolMetrics(object):
+    """Connection pool metrics of an sqlalchemy engine
+
+    Checkouts and checkins are counted from the events of the pool. Checkout waits are measured by the data layer when
+    it opens the session of a request.
+    """
+
+    def __init__(self, engine):
+        """Initialize a metrics instance and listen to the pool events of an engine
+
+        :param Engine engine: an sqlalchemy engine
+        """
+        self.engine = ref(engine)
+        self.lock = Lock()
+        self.sessions = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.checkout_wait = 0.0
+        self.max_checkout_wait = 0.0
+
+        event.listen(engine, 'checkout', self.on_checkout)
+        event.listen(engine, 'checkin', self.on_checkin)
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self.lock:
+            self.checkouts += 1
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.checkins += 1
+
+    def record_session(self, checkout_wait):
+        """Record the opening of a session
+
+        :param float checkout_wait: the number of seconds spent to get a connection from the pool
+        """
+        with self.lock:
+            self.sessions += 1
+            self.checkout_wait += checkout_wait
+            self.max_checkout_wait = max(self.max_checkout_wait, checkout_wait)
+
+    def as_dict(self):
+        """Get the metrics
+
+        :return dict: the metrics of the pool
+        """
+        engine = self.engine()
+        pool = engine.pool if engine is not None else None
+        with self.lock:
+            metrics = {'sessions': self.sessions,
+                       'checkouts': self.checkouts,
+                       'checkins': self.checkins,
+                       'checked_out': self.checkouts - self.checkins,
+                       'checkout_wait': self.checkout_wait,
+                       'max_checkout_wait': self.max_checkout_wait}
+        if isinstance(pool, QueuePool):
+            metrics.update({'pool_size': pool.size(), 'overflow': pool.overflow()})
+
+        return metrics
+
+
+# metrics by engine, dropped when the engine is garbage collected
+pool_metrics = WeakKeyDictionary()
+pool_metrics_lock = Lock()
+
+
+def get_pool_metrics(bind):
+    """Get the pool metrics of the engine of a bind, listening to its pool on first call
+
+    :param bind: an sqlalchemy engine or a connection of the engine
+    :return PoolMetrics: the pool metrics of the engine
+    """
+    engine = bind.engine
+    with pool_metrics_lock:
+        if engine not in pool_metrics:
+            pool_metrics[engine] = PoolMetrics(engine)
+
+        return pool_metrics[engine]
@@ -1,34 +1,65 @@
 # -*- coding: utf-8 -*-
 
-import json
 from functools import wraps
 
-from flask import request, make_response
+from flask import request
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
 
-from flask_rest_jsonapi.errors import jsonapi_errors
+from flask_rest_jsonapi.errors import static_error_response
+
+
+# environ key set on requests whose headers have been checked before the dispatch to the view
+HEADERS_CHECKED = 'flask_rest_jsonapi.headers_checked'
+
+# results of the negotiation of the Accept headers already seen, the cache is cleared when it's full
+accept_cache = dict()
+ACCEPT_CACHE_SIZE = 1024
+
+
+def accepts_jsonapi(accept):
+    """Check that an Accept header accepts jsonapi responses, parsing each distinct header only once
+
+    :param str accept: the value of the Accept header
+    :return bool: True if the header accepts jsonapi responses
+    """
+    accepted = accept_cache.get(accept)
+    if accepted is None:
+        accepted = 'application/vnd.api+json' in parse_accept_header(accept, MIMEAccept)
+        if len(accept_cache) >= ACCEPT_CACHE_SIZE:
+            accept_cache.clear()
+        accept_cache[accept] = accepted
+
+    return accepted
+
+
+def check_request_headers():
+    """Check headers of the current request according to jsonapi reference
+
+    :return Response: the error response if headers are invalid, None otherwise
+    """
+    request.environ[HEADERS_CHECKED] = True
+    if request.method in ('POST', 'PATCH'):
+        if request.headers.get('Content-Type') != 'application/vnd.api+json':
+            return static_error_response('invalid_content_type')
+    accept = request.headers.get('Accept')
+    if accept and not accepts_jsonapi(accept):
+        return static_error_response('invalid_accept')
+    return None
 
 
 def check_headers(func):
-    """Check headers according to jsonapi reference
+    """Check headers according to jsonapi reference, unless they have been checked before the dispatch to the view
 
     :param callable func: the function to decorate
     :return callable: the wrapped function
     """
     @wraps(func)
     def wrapper(*args, **kwargs):
-        if request.method in ('POST', 'PATCH'):
-            if 'Content-Type' not in request.headers or request.headers['Content-Type'] != 'application/vnd.api+json':
-                error = json.dumps(jsonapi_errors([{'source': '',
-                                                    'detail': "Content-Type header must be application/vnd.api+json",
-                                                    'title': 'InvalidRequestHeader',
-                                                    'status': 415}]))
-                return make_response(error, 415, {'Content-Type': 'application/vnd.api+json'})
-        if request.headers.get('Accept') and not 'application/vnd.api+json' in request.accept_mimetypes:
-            error = json.dumps(jsonapi_errors([{'source': '',
-                                                'detail': "Accept header must be application/vnd.api+json",
-                                                'title': 'InvalidRequestHeader',
-                                                'status': 406}]))
-            return make_response(error, 406, {'Content-Type': 'application/vnd.api+json'})
+        if request.environ.get(HEADERS_CHECKED) is not True:
+            error = check_request_headers()
+            if error is not None:
+                return error
         return func(*args, **kwargs)
     return wrapper
 
@@ -1,5 +1,11 @@
 # -*- coding: utf-8 -*-
 
+import json
+
+from flask import current_app
+
+from flask_rest_jsonapi.exceptions import JsonApiException, PreconditionFailed, NotModified, ObjectNotFound
+
 
 def jsonapi_errors(jsonapi_errors):
     """Construct api error according to jsonapi 1.0
@@ -9,3 +15,103 @@ def jsonapi_errors(jsonapi_errors):
     """
     return {'errors': [jsonapi_error for jsonapi_error in jsonapi_errors],
             'jsonapi': {'version': '1.0'}}
+
+
+def serialize_errors(jsonapi_errors_):
+    """Serialize a list of errors according to jsonapi 1.0
+
+    :param iterable jsonapi_errors_: an iterable of jsonapi error
+    :return bytes: the serialized errors
+    """
+    return json.dumps(jsonapi_errors(jsonapi_errors_)).encode('utf-8')
+
+
+# errors whose body doesn't depend on the request, serialized once
+STATIC_ERRORS = {
+    'invalid_content_type': (415, serialize_errors([{'source': '',
+                                                     'detail': "Content-Type header must be application/vnd.api+json",
+                                                     'title': 'InvalidRequestHeader',
+                                                     'status': 415}])),
+    'invalid_accept': (406, serialize_errors([{'source': '',
+                                               'detail': "Accept header must be application/vnd.api+json",
+                                               'title': 'InvalidRequestHeader',
+                                               'status': 406}])),
+    'unknown_error': (500, serialize_errors([JsonApiException({'pointer': ''}, 'Unknown error').to_dict()])),
+    'precondition_failed': (412, serialize_errors([PreconditionFailed({'pointer': ''},
+                                                                      'Precondition failed').to_dict()])),
+    'not_modified': (304, serialize_errors([NotModified({'pointer': ''}, 'Resource not modified').to_dict()])),
+}
+
+# bodies of not found errors serialized once per class, title and source, split around the serialized detail
+NOT_FOUND_TEMPLATES = dict()
+NOT_FOUND_TEMPLATES_MAX_SIZE = 1024
+DETAIL_PLACEHOLDER = 'jsonapi_detail_placeholder'
+
+
+def not_found_error_body(exc):
+    """Serialize the errors of a not found exception from the static body of its class, title and source, only the
+    detail (which contains the id of the object) is serialized for each error
+
+    :param ObjectNotFound exc: the not found exception
+    :return bytes: the serialized errors
+    """
+    source = exc.source
+    if isinstance(source, dict):
+        source = tuple(source.items())
+    key = (type(exc), exc.title, exc.status, source)
+    try:
+        template = NOT_FOUND_TEMPLATES.get(key)
+    except TypeError:
+        return serialize_errors([exc.to_dict()])
+
+    if template is None:
+        body = serialize_errors([dict(exc.to_dict(), detail=DETAIL_PLACEHOLDER)])
+        template = tuple(body.split(json.dumps(DETAIL_PLACEHOLDER).encode('utf-8')))
+        if len(template) != 2:
+            return serialize_errors([exc.to_dict()])
+        if len(NOT_FOUND_TEMPLATES) < NOT_FOUND_TEMPLATES_MAX_SIZE:
+            NOT_FOUND_TEMPLATES[key] = template
+
+    return template[0] + json.dumps(exc.detail).encode('utf-8') + template[1]
+
+
+def error_response(body, status, headers=None):
+    """Create the response of an error from its serialized body
+
+    :param bytes body: the serialized errors
+    :param int status: the status code of the response
+    :param headers: the headers of the response, like the headers of the resource for conditional requests
+    :return Response: the response
+    """
+    response = current_app.response_class(body, status=status, headers=headers)
+    response.headers['Content-Type'] = 'application/vnd.api+json'
+    return response
+
+
+def static_error_response(name, headers=None):
+    """Create the response of a static error
+
+    :param str name: the name of the error in STATIC_ERRORS
+    :param headers: the headers of the response
+    :return Response: the response
+    """
+    status, body = STATIC_ERRORS[name]
+    return error_response(body, status, headers)
+
+
+def exception_response(exc):
+    """Map an exception raised by a resource to the response of the error. Exceptions other than jsonapi exceptions
+    are rendered as unknown errors, with their message if the PROPOGATE_ERROR option is enabled.
+
+    :param Exception exc: the exception
+    :return Response: the response
+    """
+    if not isinstance(exc, JsonApiException):
+        if current_app.config['PROPOGATE_ERROR'] is not True:
+            return static_error_response('unknown_error')
+        exc = JsonApiException({'pointer': ''}, str(exc))
+
+    if isinstance(exc, ObjectNotFound):
+        return error_response(not_found_error_body(exc), exc.status)
+
+    return error_response(serialize_errors([exc.to_dict()]), exc.status)
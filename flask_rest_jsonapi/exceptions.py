@@ -63,6 +63,14 @@ class InvalidSort(BadRequest):
         self.detail = detail
 
 
+class InvalidAggregate(BadRequest):
+    title = "Invalid aggregate querystring parameter."
+
+    def __init__(self, detail):
+        self.source = {'parameter': 'aggregate'}
+        self.detail = detail
+
+
 class ObjectNotFound(JsonApiException):
     title = "Object not found"
     status = 404
@@ -89,3 +97,8 @@ class PreconditionFailed(JsonApiException):
 class NotModified(JsonApiException):
     title = "Not Modified"
     status = 304
+
+
+class QueryTimeout(JsonApiException):
+    title = "Query timeout"
+    status = 503
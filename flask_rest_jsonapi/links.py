@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+from threading import Lock
+
+from flask import current_app, request, url_for
+from marshmallow.utils import get_value, missing
+from marshmallow_jsonapi.flask import Schema, Relationship
+from marshmallow_jsonapi.utils import tpl
+from werkzeug.routing import BuildError, IntegerConverter, PathConverter, UnicodeConverter
+from werkzeug.urls import url_quote
+
+
+class LinkTemplate(object):
+    """Template of the path of an endpoint, built once with url_for and filled with string formatting
+
+    An endpoint is templated only if a single rule of the endpoint can be built from the arguments and its arguments
+    use the default, path or int converters, other links are built with url_for. Values of string arguments are
+    quoted like werkzeug converters do and values of integer arguments are converted to int. The script root of the
+    request is prepended to the path when the link is built, like url_for does.
+    """
+
+    def __init__(self, endpoint, arguments):
+        """Initialize a link template, in an application context
+
+        :param str endpoint: the endpoint of the url
+        :param tuple arguments: the names of the arguments of the url
+        """
+        self.endpoint = endpoint
+        self.arguments = arguments
+        self.converters = dict()
+        self.template = None
+
+        if current_app.url_map.host_matching or current_app.config.get('SERVER_NAME'):
+            return
+
+        try:
+            rules = list(current_app.url_map.iter_rules(endpoint))
+        except KeyError:
+            return
+        rules = [rule for rule in rules if rule.suitable_for(arguments)]
+        if len(rules) != 1 or rules[0].defaults or rules[0].arguments != set(arguments):
+            return
+
+        values = dict()
+        for index, argument in enumerate(arguments):
+            converter = rules[0]._converters[argument]
+            if type(converter) in (UnicodeConverter, PathConverter):
+                values[argument] = 'jsonapi{}placeholder'.format(index)
+                self.converters[argument] = url_quote
+            elif type(converter) is IntegerConverter and not converter.fixed_digits:
+                values[argument] = 4221373 + index
+                self.converters[argument] = lambda value: str(int(value))
+            else:
+                return
+
+        with current_app.test_request_context():
+            script_root = request.script_root
+            try:
+                url = url_for(endpoint, **values)
+            except (BuildError, ValueError):
+                return
+
+        if not url.startswith(script_root + '/'):
+            return
+        url = url[len(script_root):]
+        if url.startswith('//') or '?' in url:
+            return
+        url = url.replace('{', '{{').replace('}', '}}')
+        for argument, placeholder in values.items():
+            if url.count(str(placeholder)) != 1:
+                return
+            url = url.replace(str(placeholder), '{' + argument + '}')
+        self.template = url
+
+    def build(self, **kwargs):
+        """Build the url of the endpoint
+
+        :param dict kwargs: the values of the arguments of the url
+        :return str: the url
+        """
+        if self.template is None or set(kwargs) != set(self.arguments) or None in kwargs.values():
+            return url_for(self.endpoint, **kwargs)
+
+        return request.script_root + self.template.format(**{argument: self.converters[argument](value)
+                                                             for argument, value in kwargs.items()})
+
+
+link_templates = dict()
+link_templates_lock = Lock()
+
+
+def get_link_template(endpoint, arguments):
+    """Get the link template of an endpoint of the current application. Templates of endpoints that are not registered
+    yet are not kept so that they are compiled again once the endpoint is registered.
+
+    :param str endpoint: the endpoint of the url
+    :param tuple arguments: the names of the arguments of the url
+    :return LinkTemplate: the link template
+    """
+    key = (current_app._get_current_object(), endpoint, arguments)
+    link_template = link_templates.get(key)
+    if link_template is None:
+        link_template = LinkTemplate(endpoint, arguments)
+        if endpoint in current_app.view_functions:
+            with link_templates_lock:
+                link_template = link_templates.setdefault(key, link_template)
+
+    return link_template
+
+
+def build_link(endpoint, **kwargs):
+    """Build the url of an endpoint from its link template
+
+    :param str endpoint: the endpoint of the url
+    :param dict kwargs: the values of the arguments of the url
+    :return str: the url
+    """
+    return get_link_template(endpoint, tuple(sorted(kwargs))).build(**kwargs)
+
+
+def resolve_view_kwargs(obj, view_kwargs, default=missing):
+    """Resolve the values of view kwargs enclosed in < > to attributes of an object, like resolve_params of
+    marshmallow jsonapi, except that an attribute of an empty relationship resolves to None
+
+    :param obj: the object to read the attributes from
+    :param dict view_kwargs: the view kwargs
+    :param default: the value of missing attributes
+    :return dict: the resolved view kwargs
+    """
+    kwargs = dict()
+    for key, value in view_kwargs.items():
+        attr_name = tpl(str(value))
+        if attr_name:
+            value = obj
+            for field in attr_name.split('.'):
+                if value is None:
+                    break
+                value = get_value(field, value, default=default)
+                if value is missing:
+                    raise AttributeError("{!r} is not a valid attribute of {!r}".format(attr_name, obj))
+        kwargs[key] = value
+
+    return kwargs
+
+
+def get_schema_links(schema_cls):
+    """Get the endpoints and argument names of the links of a schema
+
+    :param Schema schema_cls: a schema class
+    :return set: the endpoints and argument names of the links
+    """
+    links = set()
+    if schema_cls.opts.self_url:
+        links.add((schema_cls.opts.self_url, tuple(sorted(schema_cls.opts.self_url_kwargs or dict()))))
+    for field in schema_cls._declared_fields.values():
+        if isinstance(field, Relationship):
+            for view, view_kwargs in ((field.self_view, field.self_view_kwargs),
+                                      (field.related_view, field.related_view_kwargs)):
+                if view:
+                    links.add((view, tuple(sorted(view_kwargs))))
+
+    return links
+
+
+def compile_links(app, schema_cls):
+    """Compile the link templates of a schema for an application
+
+    :param Application app: a flask application
+    :param Schema schema_cls: a schema class
+    """
+    with app.app_context():
+        for endpoint, arguments in get_schema_links(schema_cls):
+            get_link_template(endpoint, arguments)
+
+
+def generate_url(schema, view_name, **kwargs):
+    """Generate the url of a link of a schema from its link template, replaces Schema.generate_url
+
+    :param Schema schema: a schema instance
+    :param str view_name: the endpoint of the url
+    :param dict kwargs: the values of the arguments of the url
+    :return str: the url
+    """
+    return build_link(view_name, **kwargs) if view_name else None
+
+
+def get_relationship_url(field, obj, view_name, view_kwargs):
+    """Get the url of a link of a relationship from its link template, replaces Relationship.get_url
+
+    :param Relationship field: a relationship field
+    :param obj: the object to serialize
+    :param str view_name: the endpoint of the url
+    :param dict view_kwargs: the view kwargs of the link
+    :return str: the url
+    """
+    if view_name:
+        kwargs = resolve_view_kwargs(obj, view_kwargs, default=field.default)
+        try:
+            return build_link(view_name, **kwargs)
+        except BuildError:
+            if None in kwargs.values():
+                return None
+            raise
+    return None
+
+
+def use_link_templates(schema):
+    """Make a schema instance and its relationship fields build their links from link templates, unless their classes
+    customize url generation
+
+    :param Schema schema: a schema instance
+    """
+    if type(schema).generate_url is Schema.generate_url:
+        schema.generate_url = generate_url.__get__(schema)
+    for field in schema.fields.values():
+        if isinstance(field, Relationship) and type(field).get_url is Relationship.get_url:
+            field.get_url = get_relationship_url.__get__(field)
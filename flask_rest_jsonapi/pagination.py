@@ -1,11 +1,41 @@
 # -*- coding: utf-8 -*-
 
-from six.moves.urllib.parse import urlencode
+from six.moves.urllib.parse import urlencode, quote_plus
 from math import ceil
-from copy import copy
 
 from flask_rest_jsonapi.constants import DEFAULT_PAGE_SIZE
 
+PAGE_NUMBER = 'page[number]'
+
+
+class PaginationLinks(object):
+    """Builder of the pagination links of a request
+
+    The querystring parameters other than the page number are encoded once, sorted by name so that the links of a
+    collection don't depend on the order of the parameters of the request, and the page number is appended to them for
+    each link.
+    """
+
+    def __init__(self, base_url, querystring_args):
+        """Encode the invariant part of the links
+
+        :param str base_url: the base url for pagination
+        :param dict querystring_args: the managed querystring parameters of the request
+        """
+        query = urlencode(sorted((key, value) for key, value in querystring_args.items() if key != PAGE_NUMBER))
+        self.base = '?'.join((base_url, query)) if query else base_url
+        self.page_prefix = ('&' if query else '?') + quote_plus(PAGE_NUMBER) + '='
+
+    def link(self, number=None):
+        """Build the link of a page
+
+        :param number: the page number or None for a link without page number
+        :return str: the link
+        """
+        if number is None:
+            return self.base
+        return self.base + self.page_prefix + quote_plus(str(number))
+
 
 def add_pagination_links(data, object_count, querystring, base_url):
     """Add pagination links to result
@@ -15,39 +45,28 @@ def add_pagination_links(data, object_count, querystring, base_url):
     :param QueryStringManager querystring: the managed querystring fields and values
     :param str base_url: the base url for pagination
     """
-    links = {}
-    all_qs_args = copy(querystring.querystring)
-
-    links['self'] = base_url
+    all_qs_args = querystring.querystring
+    pagination = querystring.pagination
+    builder = PaginationLinks(base_url, all_qs_args)
 
     # compute self link
-    if all_qs_args:
-        links['self'] += '?' + urlencode(all_qs_args)
+    links = {'self': builder.link(all_qs_args.get(PAGE_NUMBER))}
 
-    if querystring.pagination.get('size') != '0' and object_count > 1:
+    if pagination.get('size') != '0' and object_count > 1:
         # compute last link
-        page_size = int(querystring.pagination.get('size', 0)) or DEFAULT_PAGE_SIZE
+        page_size = int(pagination.get('size', 0)) or DEFAULT_PAGE_SIZE
         last_page = int(ceil(object_count / page_size))
 
         if last_page > 1:
-            links['first'] = links['last'] = base_url
-
-            all_qs_args.pop('page[number]', None)
-
-            # compute first link
-            if all_qs_args:
-                links['first'] += '?' + urlencode(all_qs_args)
-
-            all_qs_args.update({'page[number]': last_page})
-            links['last'] += '?' + urlencode(all_qs_args)
+            # compute first and last links
+            links['first'] = builder.link()
+            links['last'] = builder.link(last_page)
 
             # compute previous and next link
-            current_page = int(querystring.pagination.get('number', 0)) or 1
+            current_page = int(pagination.get('number', 0)) or 1
             if current_page > 1:
-                all_qs_args.update({'page[number]': current_page - 1})
-                links['prev'] = '?'.join((base_url, urlencode(all_qs_args)))
+                links['prev'] = builder.link(current_page - 1)
             if current_page < last_page:
-                all_qs_args.update({'page[number]': current_page + 1})
-                links['next'] = '?'.join((base_url, urlencode(all_qs_args)))
+                links['next'] = builder.link(current_page + 1)
 
     data['links'] = links
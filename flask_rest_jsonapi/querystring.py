@@ -2,8 +2,8 @@
 
 import json
 
-from flask_rest_jsonapi.exceptions import BadRequest, InvalidFilters, InvalidSort
-from flask_rest_jsonapi.schema import get_model_field, get_relationships
+from flask_rest_jsonapi.exceptions import BadRequest, InvalidFilters, InvalidSort, InvalidAggregate
+from flask_rest_jsonapi.schema import get_model_field, get_related_schema, get_relationships
 from flask import current_app
 
 
@@ -16,9 +16,13 @@ class QueryStringManager(object):
         'page',
         'fields',
         'sort',
-        'include'
+        'include',
+        'aggregate',
+        'group'
     )
 
+    AGGREGATE_FUNCTIONS = ('count', 'sum', 'avg', 'min', 'max')
+
     def __init__(self, querystring, schema):
         """Initialization instance
 
@@ -144,6 +148,7 @@ class QueryStringManager(object):
 
             [
                 {'field': 'created_at', 'order': 'desc'},
+                {'field': 'person.name', 'order': 'asc'},
             ]
 
         """
@@ -154,17 +159,114 @@ class QueryStringManager(object):
                     field = sort_field[0].replace('-', '') + sort_field[1:].replace('-', '_')
                 else:
                     field = sort_field[0].replace('-', '') + sort_field[1:]
-                if field not in self.schema._declared_fields:
-                    raise InvalidSort("{} has no attribute {}".format(self.schema.__name__, field))
-                if field in get_relationships(self.schema).values():
-                    raise InvalidSort("You can't sort on {} because it is a relationship field".format(field))
-                field = get_model_field(self.schema, field)
+                field = self.get_sort_path(field)
                 order = 'desc' if sort_field.startswith('-') else 'asc'
                 sorting_results.append({'field': field, 'order': order})
             return sorting_results
 
         return []
 
+    def get_sort_path(self, field):
+        """Get the model path of a sort field. A dotted sort field like "owner.name" sorts on an attribute of a to one
+        relationship and "relevance" sorts on the relevance of a full text search
+
+        :param str field: the sort field
+        :return str: the dotted path of the sort field in the model
+        """
+        if field == 'relevance' and field not in self.schema._declared_fields:
+            return field
+
+        schema = self.schema
+        path = []
+        segments = field.split('.')
+        for index, segment in enumerate(segments):
+            schema_name = schema.__name__ if isinstance(schema, type) else schema.__class__.__name__
+            if segment not in schema._declared_fields:
+                raise InvalidSort("{} has no attribute {}".format(schema_name, segment))
+            is_relationship = segment in get_relationships(schema).values()
+            if index == len(segments) - 1:
+                if is_relationship:
+                    raise InvalidSort("You can't sort on {} because it is a relationship field".format(field))
+            elif not is_relationship:
+                raise InvalidSort("You can't sort on {} because {} is not a relationship field".format(field, segment))
+            elif schema._declared_fields[segment].many is True:
+                raise InvalidSort("You can't sort on {} because {} is a to many relationship".format(field, segment))
+            path.append(get_model_field(schema, segment))
+            if is_relationship:
+                schema = get_related_schema(schema, segment)
+                if schema is None:
+                    raise InvalidSort("You can't sort on {} because {} has no schema".format(field, segment))
+
+        return '.'.join(path)
+
+    @property
+    def aggregates(self):
+        """Return the aggregate functions to compute on the collection
+
+        :return list: a list of aggregate information
+
+        Example of return value for "aggregate[count]=*&aggregate[sum]=price"::
+
+            [
+                {'function': 'count', 'field': '*', 'name': '*'},
+                {'function': 'sum', 'field': 'price', 'name': 'price'},
+            ]
+
+        """
+        aggregate_results = []
+        for function, fields in self._get_key_values('aggregate').items():
+            if function not in self.AGGREGATE_FUNCTIONS:
+                raise InvalidAggregate("{} is not a valid aggregate function, valid functions are: {}"
+                                       .format(function, ', '.join(self.AGGREGATE_FUNCTIONS)))
+            for name in fields if isinstance(fields, list) else [fields]:
+                if name == '*':
+                    if function != 'count':
+                        raise InvalidAggregate("Only count can be computed on *")
+                    aggregate_results.append({'function': function, 'field': '*', 'name': name})
+                else:
+                    field = self.get_attribute_field(name, 'aggregate[{}]'.format(function))
+                    aggregate_results.append({'function': function, 'field': field, 'name': name})
+
+        return aggregate_results
+
+    @property
+    def group_by(self):
+        """Return the fields to group the aggregates of the collection by
+
+        :return list: a list of group information
+
+        Example of return value for "group[by]=status"::
+
+            [
+                {'field': 'status', 'name': 'status'},
+            ]
+
+        """
+        group_results = []
+        for key, fields in self._get_key_values('group').items():
+            if key != 'by':
+                raise BadRequest({'parameter': 'group'}, "{} is not a valid parameter of group".format(key))
+            for name in fields if isinstance(fields, list) else [fields]:
+                field = self.get_attribute_field(name, 'group[by]')
+                group_results.append({'field': field, 'name': name})
+
+        return group_results
+
+    def get_attribute_field(self, name, parameter):
+        """Get the model field of an attribute of the schema
+
+        :param str name: the name of the attribute in the querystring
+        :param str parameter: the querystring parameter containing the attribute
+        :return str: the name of the field in the model
+        """
+        field = name.replace('-', '_') if current_app.config['DASHERIZE_API'] is True else name
+        if field not in self.schema._declared_fields:
+            raise BadRequest({'parameter': parameter}, "{} has no attribute {}".format(self.schema.__name__, field))
+        if field in get_relationships(self.schema).values():
+            raise BadRequest({'parameter': parameter}, "{} is a relationship field".format(field))
+
+        return get_model_field(self.schema, field)
+
     @property
     def include(self):
         """Return fields to include
@@ -2,28 +2,46 @@
 
 import inspect
 import json
+from contextlib import contextmanager
 from copy import copy
 from six import with_metaclass
 import pytz
 from datetime import datetime
 import hashlib
+import warnings
 
 from werkzeug.wrappers import Response
-from flask import request, url_for, make_response, current_app
-from flask.views import MethodView, MethodViewType
+from werkzeug.http import http_date
+from flask import request, current_app
+from flask.views import MethodView, MethodViewType, http_method_funcs
 from marshmallow_jsonapi.exceptions import IncorrectTypeError
 from marshmallow import ValidationError
 
-from flask_rest_jsonapi.errors import jsonapi_errors
+from flask_rest_jsonapi.errors import jsonapi_errors, exception_response, static_error_response
 from flask_rest_jsonapi.querystring import QueryStringManager as QSManager
 from flask_rest_jsonapi.pagination import add_pagination_links
 from flask_rest_jsonapi.exceptions import InvalidType, BadRequest, JsonApiException, RelationNotFound, ObjectNotFound, NotModified, PreconditionFailed
 from flask_rest_jsonapi.decorators import check_headers, check_method_requirements
 from flask_rest_jsonapi.schema import compute_schema, get_relationships, get_model_field
+from flask_rest_jsonapi.serializer import CompiledSerializer
+from flask_rest_jsonapi.links import build_link, resolve_view_kwargs
 from flask_rest_jsonapi.data_layers.base import BaseDataLayer
 from flask_rest_jsonapi.data_layers.alchemy import SqlalchemyDataLayer
 
 
+def utc_datetime(value):
+    """Convert a datetime to a naive UTC datetime with the precision of HTTP dates
+
+    :param datetime value: a naive UTC or an aware datetime
+    :return datetime: the naive UTC datetime
+    """
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(pytz.utc).replace(tzinfo=None)
+    return value.replace(microsecond=0)
+
+
 class ResourceMeta(MethodViewType):
 
     def __new__(cls, name, bases, d):
@@ -38,75 +56,128 @@ class ResourceMeta(MethodViewType):
                                 .format(cls.__name__))
 
             data_layer_cls = d['data_layer'].get('class', SqlalchemyDataLayer)
-            data_layer_kwargs = d['data_layer']
+            data_layer_kwargs = dict(d['data_layer'], resource=rv)
             rv._data_layer = data_layer_cls(data_layer_kwargs)
 
+            if getattr(rv._data_layer, 'cache', None) is not None and d.get('schema') is not None:
+                rv._data_layer.cache.register(d['schema'].opts.type_, getattr(rv._data_layer, 'version_field', None))
+
+            if d.get('schema') is not None and 'deleted_at' in d['schema']._declared_fields\
+                    and hasattr(rv._data_layer, 'check_soft_delete_index'):
+                rv._data_layer.check_soft_delete_index()
+
+            if getattr(rv._data_layer, 'sortable_fields', None) is not None\
+                    and hasattr(rv._data_layer, 'check_sortable_fields'):
+                rv._data_layer.check_sortable_fields()
+
+            if getattr(rv._data_layer, 'default_sort', None) is not None\
+                    and hasattr(rv._data_layer, 'check_default_sort'):
+                rv._data_layer.check_default_sort()
+        elif getattr(rv, '_data_layer', None) is not None:
+            # a resource inheriting its data layer gets its own copy, bound to it
+            rv._data_layer = copy(rv._data_layer)
+            rv._data_layer.resource = rv
+
+        if getattr(rv, 'compiled_serializer', False) is True and d.get('schema') is not None:
+            rv._serializer = CompiledSerializer(d['schema'])
+            if rv._serializer.compiled is False:
+                warnings.warn("The schema {} can't be compiled because it customizes its serialization: {} uses "
+                              "marshmallow to serialize collections".format(d['schema'].__name__, name))
+
         rv.decorators = (check_headers,)
         if 'decorators' in d:
             rv.decorators += d['decorators']
 
+        rv._handlers = get_handlers(rv)
+
         return rv
 
+    def __setattr__(cls, name, value):
+        """Update the handlers of a resource when one of its methods is replaced, by the oauth or permission managers
+        for example
+        """
+        super(ResourceMeta, cls).__setattr__(name, value)
+        if name in http_method_funcs:
+            cls.update_handlers()
+
+    def __delattr__(cls, name):
+        super(ResourceMeta, cls).__delattr__(name)
+        if name in http_method_funcs:
+            cls.update_handlers()
+
+    def update_handlers(cls):
+        """Compute again the handlers of a resource and of its subclasses
+        """
+        resources = [cls]
+        while resources:
+            resource = resources.pop()
+            resource._handlers = get_handlers(resource)
+            resources.extend(resource.__subclasses__())
+
+
+def get_handlers(resource):
+    """Get the methods of a resource by HTTP method, HEAD requests being handled by the get method unless the resource
+    has a head method
+
+    :param Resource resource: a resource class
+    :return dict: the methods of the resource by HTTP method
+    """
+    handlers = {method.upper(): getattr(resource, method) for method in http_method_funcs
+                if getattr(resource, method, None) is not None}
+    if 'HEAD' not in handlers and 'GET' in handlers:
+        handlers['HEAD'] = handlers['GET']
+
+    return handlers
+
 
 class Resource(MethodView):
 
-    def __new__(cls):
+    @classmethod
+    def as_view(cls, name, *class_args, **class_kwargs):
+        """Create the view of a resource, binding the data layer of the resource to it. Resources inheriting their data
+        layer already get their own copy bound to them when they are declared, so this only matters for a data layer
+        assigned to the resource after its declaration.
+        """
         if hasattr(cls, '_data_layer'):
             cls._data_layer.resource = cls
 
-        return super(Resource, cls).__new__(cls)
+        return super(Resource, cls).as_view(name, *class_args, **class_kwargs)
 
     def dispatch_request(self, *args, **kwargs):
-        method = getattr(self, request.method.lower(), None)
-        if method is None and request.method == 'HEAD':
-            method = getattr(self, 'get', None)
+        handlers = getattr(self, '_handlers', None)
+        if handlers is None:
+            handlers = get_handlers(type(self))
+        method = handlers.get(request.method)
         assert method is not None, 'Unimplemented method {}'.format(request.method)
 
-        headers = {'Content-Type': 'application/vnd.api+json'}
-
         try:
-            response = method(*args, **kwargs)
+            with self.statement_timeout_context():
+                response = method(self, *args, **kwargs)
         except JsonApiException as e:
-            return make_response(json.dumps(jsonapi_errors([e.to_dict()])),
-                                 e.status,
-                                 headers)
+            return exception_response(e)
         except Exception as e:
             if current_app.config['DEBUG'] is True:
                 raise e
-            if current_app.config['PROPOGATE_ERROR'] is True:
-                exc = JsonApiException({'pointer': ''}, str(e))
-            else:
-                exc = JsonApiException({'pointer': ''}, 'Unknown error')
-            return make_response(json.dumps(jsonapi_errors([exc.to_dict()])),
-                                 exc.status,
-                                 headers)
+            return exception_response(e)
 
         if isinstance(response, Response):
             response.headers.add('Content-Type', 'application/vnd.api+json')
             resp = response
-        elif not isinstance(response, tuple):
-            if isinstance(response, dict):
-                response.update({'jsonapi': {'version': '1.0'}})
-            resp = make_response(json.dumps(response), 200, headers)
         else:
-            try:
+            data, status_code, headers = response, 200, {'Content-Type': 'application/vnd.api+json'}
+            if isinstance(response, tuple) and len(response) == 3:
                 data, status_code, headers = response
                 headers.update({'Content-Type': 'application/vnd.api+json'})
-            except ValueError:
-                pass
-
-            try:
+            elif isinstance(response, tuple) and len(response) == 2:
                 data, status_code = response
-            except ValueError:
-                pass
 
             if isinstance(data, dict):
                 data.update({'jsonapi': {'version': '1.0'}})
 
-            resp = make_response(json.dumps(data), status_code, headers)
+            resp = current_app.response_class(json.dumps(data), status=status_code, headers=headers)
 
-        # ETag Handling
-        if current_app.config['ETAG'] is True:
+        # ETag Handling, the body of a 304 response is not the representation of the resource
+        if current_app.config['ETAG'] is True and resp.status_code != 304:
             etag = hashlib.sha1(resp.get_data()).hexdigest()
             resp.headers['ETag'] = etag
 
@@ -115,18 +186,24 @@ class Resource(MethodView):
             if if_match:
                 etag_list = [tag.strip() for tag in if_match.split(',')]
                 if etag not in etag_list and '*' not in etag_list:
-                    exc = PreconditionFailed({'pointer': ''}, 'Precondition failed')
-                    return make_response(json.dumps(jsonapi_errors([exc.to_dict()])),
-                                         exc.status,
-                                         headers)
+                    return static_error_response('precondition_failed', resp.headers)
             elif if_none_match:
                 etag_list = [tag.strip() for tag in if_none_match.split(',')]
                 if etag in etag_list or '*' in etag_list:
-                    exc = NotModified({'pointer': ''}, 'Resource not modified')
-                    return make_response(json.dumps(jsonapi_errors([exc.to_dict()])),
-                                         exc.status,
-                                         headers)
-            return resp
+                    return static_error_response('not_modified', resp.headers)
+
+        return resp
+
+    @contextmanager
+    def statement_timeout_context(self):
+        """Apply the statement timeout of the data layer to the request
+        """
+        if not hasattr(getattr(self, '_data_layer', None), 'statement_timeout_context'):
+            yield
+            return
+
+        with self._data_layer.statement_timeout_context(request.method):
+            yield
 
 
 class ResourceList(with_metaclass(ResourceMeta, Resource)):
@@ -138,6 +215,12 @@ class ResourceList(with_metaclass(ResourceMeta, Resource)):
         self.before_get(args, kwargs)
 
         qs = QSManager(request.args, self.schema)
+        if qs.aggregates or qs.group_by:
+            aggregates = self._data_layer.get_aggregates(qs, kwargs)
+            result = {'meta': {'aggregates': aggregates}}
+            self.after_get(result)
+            return result
+
         objects_count, objects = self._data_layer.get_collection(qs, kwargs)
 
         schema_kwargs = getattr(self, 'get_schema_kwargs', dict())
@@ -146,15 +229,20 @@ class ResourceList(with_metaclass(ResourceMeta, Resource)):
         schema = compute_schema(self.schema,
                                 schema_kwargs,
                                 qs,
-                                qs.include)
+                                qs.include,
+                                cache=getattr(self._data_layer, 'cache', None))
 
-        result = schema.dump(objects).data
+        serializer = getattr(self, '_serializer', None)
+        if serializer is not None and serializer.compiled is True and not qs.include:
+            result = serializer.dump(objects, schema)
+        else:
+            result = schema.dump(objects).data
 
         view_kwargs = request.view_args if getattr(self, 'view_kwargs', None) is True else dict()
         add_pagination_links(result,
                              objects_count,
                              qs,
-                             url_for(self.view, **view_kwargs))
+                             build_link(self.view, **view_kwargs))
 
         result.update({'meta': {'count': objects_count}})
 
@@ -203,6 +291,63 @@ class ResourceList(with_metaclass(ResourceMeta, Resource)):
         self.after_post(result)
         return result, 201, {'Location': result['data']['links']['self']}
 
+    @check_method_requirements
+    def patch(self, *args, **kwargs):
+        """Restore the soft deleted objects of a collection matching the filters
+        """
+        self.check_bulk_operations()
+        self.before_patch(args, kwargs)
+
+        if request.args.get('restore') != 'true':
+            raise BadRequest({'parameter': 'restore'}, 'Only the restore of soft deleted objects is supported')
+        self.check_soft_delete()
+
+        qs = QSManager(request.args, self.schema)
+        count = self._data_layer.update_collection(qs, kwargs, {'deleted_at': None}, trashed=True)
+
+        result = {'meta': {'message': 'Objects successfully restored', 'count': count}}
+        self.after_patch(result)
+        return result
+
+    @check_method_requirements
+    def delete(self, *args, **kwargs):
+        """Delete the objects of a collection matching the filters
+        """
+        self.check_bulk_operations()
+        self.before_delete(args, kwargs)
+
+        qs = QSManager(request.args, self.schema)
+        if request.args.get('purge') == 'true':
+            self.check_soft_delete()
+            count = self._data_layer.delete_collection(qs, kwargs, trashed=True)
+        else:
+            if not qs.filters:
+                raise BadRequest({'parameter': 'filter'}, 'Filters are required to delete objects of a collection')
+            if 'deleted_at' not in self.schema._declared_fields or request.args.get('permanent') == 'true' or current_app.config['SOFT_DELETE'] is False:
+                count = self._data_layer.delete_collection(qs, kwargs)
+            else:
+                count = self._data_layer.update_collection(qs, kwargs, {'deleted_at': datetime.now(pytz.utc)},
+                                                           trashed=False)
+
+        result = {'meta': {'message': 'Objects successfully deleted', 'count': count}}
+        self.after_delete(result)
+        return result
+
+    def check_bulk_operations(self):
+        """Check that bulk operations are enabled on the resource
+        """
+        if getattr(self, 'bulk_operations', False) is not True:
+            raise JsonApiException({'pointer': ''},
+                                   'Bulk operations are not enabled on this resource',
+                                   title='Method Not Allowed',
+                                   status=405)
+
+    def check_soft_delete(self):
+        """Check that soft delete is enabled on the resource
+        """
+        if 'deleted_at' not in self.schema._declared_fields or current_app.config['SOFT_DELETE'] is False:
+            raise BadRequest({'pointer': ''}, 'Soft delete is not enabled on this resource')
+
     def before_get(self, args, kwargs):
         pass
 
@@ -215,6 +360,18 @@ class ResourceList(with_metaclass(ResourceMeta, Resource)):
     def after_post(self, result):
         pass
 
+    def before_patch(self, args, kwargs):
+        pass
+
+    def after_patch(self, result):
+        pass
+
+    def before_delete(self, args, kwargs):
+        pass
+
+    def after_delete(self, result):
+        pass
+
 
 class ResourceDetail(with_metaclass(ResourceMeta, Resource)):
 
@@ -223,7 +380,17 @@ class ResourceDetail(with_metaclass(ResourceMeta, Resource)):
         """Get object details
         """
         self.before_get(args, kwargs)
-        if request.args.get('get_trashed') == 'true':
+
+        # If-None-Match takes precedence over If-Modified-Since so that the 304 response carries the ETag
+        get_trashed = request.args.get('get_trashed') == 'true'
+        if request.if_modified_since is not None and \
+                not (current_app.config['ETAG'] is True and request.headers.get('If-None-Match')):
+            last_modified = self.get_last_modified(kwargs, get_trashed=get_trashed)
+            if last_modified is not None and last_modified <= utc_datetime(request.if_modified_since):
+                return jsonapi_errors([NotModified({'pointer': ''}, 'Resource not modified').to_dict()]), 304,\
+                    {'Last-Modified': http_date(last_modified)}
+
+        if get_trashed:
             obj = self._data_layer.get_object(kwargs, get_trashed=True)
         else:
             obj = self._data_layer.get_object(kwargs)
@@ -232,15 +399,27 @@ class ResourceDetail(with_metaclass(ResourceMeta, Resource)):
             raise ObjectNotFound({'pointer': ''}, 'Object Not Found')
         qs = QSManager(request.args, self.schema)
 
+        cache = getattr(self._data_layer, 'cache', None)
         schema = compute_schema(self.schema,
                                 getattr(self, 'get_schema_kwargs', dict()),
                                 qs,
-                                qs.include)
+                                qs.include,
+                                cache=cache)
 
-        result = schema.dump(obj).data
+        cache_key = None
+        if cache is not None and not schema.include_data:
+            cache_key = cache.key(schema, obj)
+
+        item = cache.get(cache_key) if cache_key is not None else None
+        if item is not None:
+            result = schema.wrap_response(item, False)
+        else:
+            result = schema.dump(obj).data
+            if cache_key is not None:
+                cache.set(cache_key, result['data'])
 
         self.after_get(result)
-        return result
+        return result, 200, self.last_modified_headers(obj)
 
     @check_method_requirements
     def patch(self, *args, **kwargs):
@@ -285,26 +464,35 @@ class ResourceDetail(with_metaclass(ResourceMeta, Resource)):
 
         self.before_patch(args, kwargs, data=data)
 
-        if request.args.get('get_trashed') == 'true':
-            obj = self._data_layer.get_object(kwargs, get_trashed=True)
+        get_trashed = request.args.get('get_trashed') == 'true'
+        self.check_unmodified_since(kwargs, get_trashed=get_trashed)
+
+        if getattr(self._data_layer, 'update_returning', False) is True:
+            obj = self._data_layer.update_object_returning(data, kwargs, get_trashed=get_trashed)
+            if obj is None:
+                raise ObjectNotFound({'pointer': ''}, 'Object Not Found')
         else:
-            obj = self._data_layer.get_object(kwargs)
+            if get_trashed:
+                obj = self._data_layer.get_object(kwargs, get_trashed=True)
+            else:
+                obj = self._data_layer.get_object(kwargs)
 
-        if obj is None:
-            raise ObjectNotFound({'pointer': ''}, 'Object Not Found')
+            if obj is None:
+                raise ObjectNotFound({'pointer': ''}, 'Object Not Found')
 
-        self._data_layer.update_object(obj, data, kwargs)
+            self._data_layer.update_object(obj, data, kwargs)
 
         result = schema.dump(obj).data
 
         self.after_patch(result)
-        return result
+        return result, 200, self.last_modified_headers(obj)
 
     @check_method_requirements
     def delete(self, *args, **kwargs):
         """Delete an object
         """
         self.before_delete(args, kwargs)
+        self.check_unmodified_since(kwargs, get_trashed=(request.args.get('permanent') == 'true'))
         obj = self._data_layer.get_object(kwargs, get_trashed=(request.args.get('permanent') == 'true'))
         if obj is None:
             raise ObjectNotFound({'pointer': ''}, 'Object Not Found')
@@ -318,6 +506,44 @@ class ResourceDetail(with_metaclass(ResourceMeta, Resource)):
         self.after_delete(result)
         return result
 
+    def get_last_modified(self, kwargs, get_trashed=False):
+        """Get the last modification date of the object without loading it
+
+        :param dict kwargs: kwargs from the resource view
+        :param bool get_trashed: whether soft deleted objects can be retrieved
+        :return datetime: the last modification date of the object in UTC or None
+        """
+        if getattr(self._data_layer, 'last_modified_field', None) is None:
+            return None
+
+        return utc_datetime(self._data_layer.get_last_modified(kwargs, get_trashed=get_trashed))
+
+    def check_unmodified_since(self, kwargs, get_trashed=False):
+        """Check the If-Unmodified-Since header before to modify the object
+
+        :param dict kwargs: kwargs from the resource view
+        :param bool get_trashed: whether soft deleted objects can be retrieved
+        """
+        if request.if_unmodified_since is None:
+            return
+
+        last_modified = self.get_last_modified(kwargs, get_trashed=get_trashed)
+        if last_modified is not None and last_modified > utc_datetime(request.if_unmodified_since):
+            raise PreconditionFailed({'pointer': ''}, 'Resource modified since {}'
+                                     .format(request.headers['If-Unmodified-Since']))
+
+    def last_modified_headers(self, obj):
+        """Compute the Last-Modified header of the response
+
+        :param obj: an object from data layer
+        :return dict: the headers of the response
+        """
+        last_modified_field = getattr(self._data_layer, 'last_modified_field', None)
+        if last_modified_field is None or getattr(obj, last_modified_field, None) is None:
+            return dict()
+
+        return {'Last-Modified': http_date(utc_datetime(getattr(obj, last_modified_field)))}
+
     def before_get(self, args, kwargs):
         pass
 
@@ -349,25 +575,35 @@ class ResourceRelationship(with_metaclass(ResourceMeta, Resource)):
         related_view = self.schema._declared_fields[relationship_field].related_view
         related_view_kwargs = self.schema._declared_fields[relationship_field].related_view_kwargs
 
-        obj, data = self._data_layer.get_relationship(model_relationship_field,
-                                                      related_type_,
-                                                      related_id_field,
-                                                      kwargs)
+        qs = QSManager(request.args, self.schema)
+        if self.schema._declared_fields[relationship_field].many and qs.pagination:
+            obj, data, related_count = self._data_layer.get_relationship_page(model_relationship_field,
+                                                                              related_type_,
+                                                                              related_id_field,
+                                                                              kwargs,
+                                                                              qs.pagination)
+        else:
+            related_count = None
+            obj, data = self._data_layer.get_relationship(model_relationship_field,
+                                                          related_type_,
+                                                          related_id_field,
+                                                          kwargs)
 
-        for key, value in copy(related_view_kwargs).items():
-            if isinstance(value, str) and value.startswith('<') and value.endswith('>'):
-                tmp_obj = obj
-                for field in value[1:-1].split('.'):
-                    tmp_obj = getattr(tmp_obj, field)
-                related_view_kwargs[key] = tmp_obj
+        # resolve the view kwargs in a new dict: the kwargs of the field are shared by all requests
+        related_view_kwargs = resolve_view_kwargs(obj, related_view_kwargs)
 
-        result = {'links': {'self': request.path,
-                            'related': url_for(related_view, **related_view_kwargs)},
+        result = {'links': {'self': request.path},
                   'data': data}
 
-        qs = QSManager(request.args, self.schema)
+        if related_count is not None:
+            add_pagination_links(result, related_count, qs, request.path)
+
+        # the related link of an empty relationship can't be built when it depends on the related object
+        if None not in related_view_kwargs.values():
+            result['links']['related'] = build_link(related_view, **related_view_kwargs)
+
         if qs.include:
-            schema = compute_schema(self.schema, dict(), qs, qs.include)
+            schema = compute_schema(self.schema, dict(), qs, qs.include, cache=getattr(self._data_layer, 'cache', None))
 
             serialized_obj = schema.dump(obj)
             result['included'] = serialized_obj.data.get('included', dict())
@@ -1,19 +1,27 @@
 # -*- coding: utf-8 -*-
 
-from marshmallow import class_registry
+import types
+from collections import OrderedDict
+from functools import partial
+
+from marshmallow import class_registry, ValidationError
 from marshmallow.base import SchemaABC
+from marshmallow.exceptions import RegistryError
 from marshmallow_jsonapi.fields import Relationship
 
 from flask_rest_jsonapi.exceptions import InvalidField, InvalidInclude
+from flask_rest_jsonapi.links import use_link_templates
 
 
-def compute_schema(schema_cls, default_kwargs, qs, include):
+def compute_schema(schema_cls, default_kwargs, qs, include, included_data=None, cache=None):
     """Compute a schema around compound documents and sparse fieldsets
 
     :param Schema schema_cls: the schema class
     :param dict default_kwargs: the schema default kwargs
     :param QueryStringManager qs: qs
     :param list include: the relation field to include data from
+    :param dict included_data: the included data registry of the root schema when computing a related schema
+    :param ResourceCache cache: the cache of serialized resource objects used for included data
 
     :return Schema schema: the schema computed
     """
@@ -28,14 +36,21 @@ def compute_schema(schema_cls, default_kwargs, qs, include):
                 raise InvalidInclude("{} has no attribute {}".format(schema_cls.__name__, field))
             elif not isinstance(schema_cls._declared_fields[field], Relationship):
                 raise InvalidInclude("{} is not a relationship attribute of {}".format(field, schema_cls.__name__))
-            schema_kwargs['include_data'] += (field, )
+            if field not in schema_kwargs['include_data']:
+                schema_kwargs['include_data'] += (field, )
 
     # make sure id field is in only parameter unless marshamllow will raise an Exception
     if schema_kwargs.get('only') is not None and 'id' not in schema_kwargs['only']:
         schema_kwargs['only'] += ('id',)
 
-    # create base schema instance
+    # create base schema instance, building its links from link templates
     schema = schema_cls(**schema_kwargs)
+    use_link_templates(schema)
+
+    # related schemas share the included data registry of the root schema
+    if included_data is not None:
+        schema.included_data = included_data
+        schema.render_included_data = types.MethodType(render_related_included_data, schema)
 
     # manage sparse fieldsets
     if schema.opts.type_ in qs.fields:
@@ -55,8 +70,15 @@ def compute_schema(schema_cls, default_kwargs, qs, include):
 
     # manage compound documents
     if include:
+        # group include paths by relationship so each related schema is computed only once
+        related_includes = OrderedDict()
         for include_path in include:
-            field = include_path.split('.')[0]
+            field, _, related_include = include_path.partition('.')
+            related_includes.setdefault(field, [])
+            if related_include and related_include not in related_includes[field]:
+                related_includes[field].append(related_include)
+
+        for field, related_include in related_includes.items():
             relation_field = schema.declared_fields[field]
             related_schema_cls = schema.declared_fields[field].__dict__['_Relationship__schema']
             related_schema_kwargs = {}
@@ -65,16 +87,66 @@ def compute_schema(schema_cls, default_kwargs, qs, include):
                 related_schema_cls = related_schema_cls.__class__
             if isinstance(related_schema_cls, str):
                 related_schema_cls = class_registry.get_class(related_schema_cls)
-            if '.' in include_path:
-                related_include = ['.'.join(include_path.split('.')[1:])]
-            else:
-                related_include = None
-            related_schema = compute_schema(related_schema_cls, related_schema_kwargs, qs, related_include)
+            related_schema = compute_schema(related_schema_cls,
+                                            related_schema_kwargs,
+                                            qs,
+                                            related_include or None,
+                                            included_data=schema.included_data,
+                                            cache=cache)
             relation_field.__dict__['_Relationship__schema'] = related_schema
+            relation_field._serialize_included = types.MethodType(partial(serialize_included, cache=cache),
+                                                                  relation_field)
 
     return schema
 
 
+def serialize_included(field, value, cache=None):
+    """Serialize a related object into the included data of the root schema, only once per (type, id)
+
+    :param Relationship field: the relationship field
+    :param value: the related object
+    :param ResourceCache cache: the cache of serialized resource objects
+    """
+    included_data = field.root.included_data
+    key = (field.type_, str(field._get_id(value)))
+    if key in included_data:
+        return
+
+    # related objects with nested includes can't be cached because their included data must be serialized too
+    cache_key = None
+    if cache is not None and not field.schema.include_data:
+        cache_key = cache.key(field.schema, value)
+        item = cache.get(cache_key) if cache_key is not None else None
+        if item is not None:
+            included_data[key] = item
+            return
+
+    # reserve the key before serializing so that circular includes don't serialize it again
+    included_data[key] = None
+    result = field.schema.dump(value)
+    if result.errors:
+        raise ValidationError(result.errors)
+    item = result.data['data']
+    if cache_key is not None:
+        cache.set(cache_key, item)
+    if (item['type'], item['id']) != key:
+        included_data.pop(key)
+    included_data[(item['type'], item['id'])] = item
+
+    if field.schema.included_data is not included_data:
+        included_data.update(field.schema.included_data)
+
+
+def render_related_included_data(schema, data):
+    """Skip rendering of included data for related schemas because the root schema renders it
+
+    :param Schema schema: a related schema
+    :param dict data: the serialized data
+    :return dict: the serialized data
+    """
+    return data
+
+
 def get_model_field(schema, field):
     """Get the model field of a schema field
 
@@ -87,6 +159,29 @@ def get_model_field(schema, field):
     return field
 
 
+def get_related_schema(schema, field):
+    """Get the schema class of a relationship field of a schema, without instantiating the related schema on the field
+    declared by the schema class
+
+    :param Schema schema: a marshmallow schema
+    :param str field: the name of the relationship field
+    :return Schema: the related schema class or None if the relationship has no schema
+    """
+    related_schema = schema._declared_fields[field].__dict__.get('_Relationship__schema')
+    if isinstance(related_schema, SchemaABC):
+        return related_schema.__class__
+    if isinstance(related_schema, type) and issubclass(related_schema, SchemaABC):
+        return related_schema
+    if isinstance(related_schema, str):
+        if related_schema == 'self':
+            return schema if isinstance(schema, type) else schema.__class__
+        try:
+            return class_registry.get_class(related_schema)
+        except RegistryError:
+            return None
+    return None
+
+
 def get_relationships(schema):
     """Return relationship mapping from schema to model
 
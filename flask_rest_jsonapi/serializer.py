@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+from marshmallow import fields
+from marshmallow.decorators import PRE_DUMP, POST_DUMP
+from marshmallow.utils import missing
+from marshmallow_jsonapi.fields import BaseRelationship, Meta
+from marshmallow_jsonapi.flask import Schema, Relationship
+from marshmallow_jsonapi.schema import Schema as JsonApiSchema
+from marshmallow_jsonapi.utils import resolve_params, tpl
+from werkzeug.routing import BuildError
+
+from flask_rest_jsonapi.links import get_link_template, resolve_view_kwargs, use_link_templates
+
+
+# fields serialized by a direct call to their _serialize method
+SIMPLE_FIELDS = (fields.String, fields.Integer, fields.Float, fields.Boolean, fields.DateTime, fields.LocalDateTime,
+                 fields.Date, fields.Time, fields.UUID, fields.Email, fields.Url)
+
+# methods of marshmallow jsonapi schemas that prevent the compilation of a schema when they are overridden
+OVERRIDABLE_METHODS = ('format_item', 'format_items', 'wrap_response', 'get_resource_links', 'get_top_level_links',
+                       'generate_url', 'inflect', 'get_attribute')
+
+
+class CompiledSerializer(object):
+    """Serializer of a collection generated from the declared fields of a schema
+
+    Simple fields are serialized with a direct call to their _serialize method and other fields, like relationships,
+    through marshmallow, without the per object machinery of Schema.dump. Load only fields are not serialized. Objects
+    can be model instances or sqlalchemy rows whose keys are the attributes of the fields, see get_row_attributes.
+    """
+
+    def __init__(self, schema_cls):
+        """Compile the serializer of a schema
+
+        :param Schema schema_cls: the schema class
+        """
+        self.schema = schema_cls()
+        use_link_templates(self.schema)
+        self.compiled = self.is_compilable()
+        self.fields = []
+
+        if self.compiled is False:
+            return
+
+        for name, field in self.schema.fields.items():
+            if field.load_only:
+                continue
+            key = self.schema.inflect(field.dump_to or name)
+            attribute = field.attribute or name
+            if name == 'id':
+                kind = 'id'
+            elif isinstance(field, BaseRelationship):
+                kind = 'relationships'
+            else:
+                kind = 'attributes'
+            if type(field) in SIMPLE_FIELDS and '.' not in attribute:
+                mode = 'simple'
+            elif type(field) is Relationship and not field.include_resource_linkage:
+                mode = 'links'
+            else:
+                mode = 'field'
+            self.fields.append((name, field.dump_to or name, key, attribute, kind, mode, field))
+
+        self.link_arguments = tuple(sorted(self.schema.opts.self_url_kwargs or dict()))
+        self.attributes = self.get_row_attributes()
+
+    def get_row_attributes(self, names=None):
+        """Get the attributes read by the serializer when all fields can be serialized from rows, which is the case
+        when fields are simple fields or relationships serialized from their links only
+
+        :param set names: the names of the serialized fields, like the sparse fieldset of a request, or None for all
+                          fields
+        :return set: the attributes read by the serializer or None if some fields need objects
+        """
+        attributes = set()
+        for name, dump_key, key, attribute, kind, mode, field in self.fields:
+            if names is not None and name not in names:
+                continue
+            if mode == 'simple':
+                attributes.add(attribute)
+            elif mode == 'links':
+                for view, view_kwargs in ((field.self_view, field.self_view_kwargs),
+                                          (field.related_view, field.related_view_kwargs)):
+                    if view:
+                        attributes.update(tpl(str(value)) for value in view_kwargs.values() if tpl(str(value)))
+            else:
+                return None
+
+        return attributes
+
+    def is_compilable(self):
+        """Check that the schema only uses the default serialization of marshmallow jsonapi
+
+        :return bool: True if the schema can be compiled
+        """
+        schema = self.schema
+        processors = [schema.__processors__[(tag, pass_many)] for tag in (PRE_DUMP, POST_DUMP)
+                      for pass_many in (True, False)]
+        if [attr_name for processor in processors for attr_name in processor] != ['format_json_api_response']:
+            return False
+        if schema.opts.fields or schema.opts.additional or getattr(schema, 'extra', None):
+            return False
+        if any(isinstance(field, Meta) for field in schema.fields.values()):
+            return False
+        for cls in type(schema).__mro__:
+            if cls in (Schema, JsonApiSchema):
+                break
+            if any(method in cls.__dict__ for method in OVERRIDABLE_METHODS):
+                return False
+        else:
+            return False
+
+        return True
+
+    def dump(self, objects, schema=None):
+        """Serialize a collection of objects
+
+        :param list objects: the objects to serialize
+        :param Schema schema: the schema computed for the request, restricting the serialized fields
+        :return dict: the serialized collection
+        """
+        names = None
+        if schema is not None:
+            names = set(schema.fields) & set(schema.only) if schema.only else set(schema.fields)
+        compiled_fields = [compiled_field for compiled_field in self.fields
+                           if names is None or compiled_field[0] in names]
+        dict_class = self.schema.dict_class
+        type_ = self.schema.opts.type_
+        accessor = self.schema.get_attribute
+        self_view = self.schema.opts.self_url
+        link_template = get_link_template(self_view, self.link_arguments) if self_view else None
+
+        relationship_templates = dict()
+        for name, dump_key, key, attribute, kind, mode, field in compiled_fields:
+            if mode == 'links':
+                relationship_templates[name] = [
+                    (link, view, view_kwargs, get_link_template(view, tuple(sorted(view_kwargs))))
+                    for link, view, view_kwargs in (('self', field.self_view, field.self_view_kwargs),
+                                                    ('related', field.related_view, field.related_view_kwargs))
+                    if view]
+
+        data = []
+        for obj in objects:
+            item = dict_class()
+            item['type'] = type_
+            values = dict()
+            for name, dump_key, key, attribute, kind, mode, field in compiled_fields:
+                if mode == 'simple':
+                    value = getattr(obj, attribute, missing)
+                    value = field.serialize(name, obj, accessor=accessor) if value is missing \
+                        else field._serialize(value, name, obj)
+                elif mode == 'links':
+                    value = self.serialize_links(obj, field, relationship_templates[name])
+                else:
+                    value = field.serialize(name, obj, accessor=accessor)
+                if value is missing:
+                    continue
+                values[dump_key] = value
+                if kind == 'id':
+                    item['id'] = value
+                elif kind == 'relationships':
+                    if value:
+                        item.setdefault('relationships', dict_class())[key] = value
+                else:
+                    item.setdefault('attributes', dict_class())[key] = value
+
+            if link_template is not None:
+                item['links'] = dict_class()
+                item['links']['self'] = link_template.build(**resolve_params(values, self.schema.opts.self_url_kwargs
+                                                                             or dict()))
+            data.append(item)
+
+        result = {'data': data}
+        if self.schema.opts.self_url_many:
+            result['links'] = {'self': self.schema.generate_url(self.schema.opts.self_url_many)}
+
+        return result
+
+    def serialize_links(self, obj, field, templates):
+        """Serialize a relationship without resource linkage, whose value is not loaded because only its links are
+        serialized
+
+        :param obj: the object to serialize
+        :param Relationship field: the relationship field
+        :param list templates: the links of the relationship with their view, view kwargs and link template
+        :return dict: the serialized relationship
+        """
+        links = self.schema.dict_class()
+        for link, view, view_kwargs, link_template in templates:
+            kwargs = resolve_view_kwargs(obj, view_kwargs, default=field.default)
+            try:
+                url = link_template.build(**kwargs)
+            except BuildError:
+                if None in kwargs.values():
+                    continue
+                raise
+            links[link] = url
+
+        result = self.schema.dict_class()
+        if links:
+            result['links'] = links
+        return result
@@ -2,22 +2,38 @@
 
 from six.moves.urllib.parse import urlencode
 import pytest
+import gc
 import json
-
-from sqlalchemy import create_engine, Column, Integer, DateTime, String, ForeignKey
+import warnings
+import weakref
+import pytz
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import create_engine, event, text, Column, Integer, DateTime, String, ForeignKey, Table, Index,\
+    FetchedValue
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import sessionmaker, relationship
 from sqlalchemy.ext.declarative import declarative_base
-from flask import Blueprint, make_response
+from flask import Flask, Blueprint, make_response, url_for
 from marshmallow_jsonapi.flask import Schema, Relationship
 from marshmallow_jsonapi import fields
 from marshmallow import ValidationError
 
 from flask_rest_jsonapi import Api, ResourceList, ResourceDetail, ResourceRelationship, JsonApiException
 from flask_rest_jsonapi.pagination import add_pagination_links
-from flask_rest_jsonapi.exceptions import RelationNotFound, InvalidSort, InvalidFilters, InvalidInclude, BadRequest
+from flask_rest_jsonapi.cache import ResourceCache
+from flask_rest_jsonapi.exceptions import RelationNotFound, InvalidSort, InvalidFilters, InvalidInclude, BadRequest,\
+    RelatedObjectNotFound, PreconditionFailed, QueryTimeout, InvalidAggregate, ObjectNotFound
 from flask_rest_jsonapi.querystring import QueryStringManager as QSManager
-from flask_rest_jsonapi.data_layers.alchemy import SqlalchemyDataLayer
+from flask_rest_jsonapi.data_layers.alchemy import SqlalchemyDataLayer, is_not_deleted_predicate, is_statement_timeout,\
+    set_sticky_cookie
 from flask_rest_jsonapi.data_layers.base import BaseDataLayer
+from flask_rest_jsonapi.data_layers.filtering.alchemy import FullTextSearch
+from flask_rest_jsonapi.serializer import CompiledSerializer
+from flask_rest_jsonapi.links import build_link, get_link_template
+from flask_rest_jsonapi.errors import jsonapi_errors, exception_response, serialize_errors, NOT_FOUND_TEMPLATES
 from flask_rest_jsonapi.data_layers.filtering.alchemy import Node
 import flask_rest_jsonapi.decorators
 import flask_rest_jsonapi.resource
@@ -68,6 +84,92 @@ def session(engine):
     return Session()
 
 
+@pytest.fixture(scope="module")
+def group_model(base, engine, person_model):
+    membership = Table('membership', base.metadata,
+                       Column('group_id', Integer, ForeignKey('group.id'), primary_key=True),
+                       Column('person_id', Integer, ForeignKey('person.person_id'), primary_key=True))
+
+    class Group(base):
+
+        __tablename__ = 'group'
+
+        id = Column(Integer, primary_key=True)
+        members = relationship(person_model, secondary=membership, backref='groups')
+    base.metadata.create_all(engine)
+    yield Group
+
+
+@pytest.fixture(scope="module")
+def document_model(base, engine):
+    class Document(base):
+
+        __tablename__ = 'document'
+
+        id = Column(Integer, primary_key=True)
+        title = Column(String)
+        version = Column(Integer, nullable=False, default=1)
+    base.metadata.create_all(engine)
+    yield Document
+
+
+@pytest.fixture(scope="module")
+def article_model(base, engine):
+    class Article(base):
+
+        __tablename__ = 'article'
+
+        id = Column(Integer, primary_key=True)
+        title = Column(String)
+        created_at = Column(DateTime)
+        deleted_at = Column(DateTime)
+        __table_args__ = (Index('ix_article_created_at', 'created_at', 'id'),)
+    base.metadata.create_all(engine)
+    yield Article
+
+
+@pytest.fixture(scope="module")
+def comment_model(base, engine):
+    class Comment(base):
+
+        __tablename__ = 'comment'
+
+        id = Column(Integer, primary_key=True)
+        deleted_at = Column(DateTime)
+        __table_args__ = (Index('ix_comment_alive', 'id', sqlite_where=deleted_at.is_(None)),)
+    base.metadata.create_all(engine)
+    yield Comment
+
+
+@pytest.fixture(scope="module")
+def tag_model(base, engine):
+    class Tag(base):
+
+        __tablename__ = 'tag'
+
+        article_id = Column(Integer, primary_key=True, autoincrement=False)
+        name = Column(String, primary_key=True)
+        label = Column(String)
+    base.metadata.create_all(engine)
+    yield Tag
+
+
+@pytest.fixture()
+def capture_statements(engine):
+    @contextmanager
+    def capture_statements_():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    yield capture_statements_
+
+
 @pytest.fixture()
 def person(session, person_model):
     person_ = person_model(name='test')
@@ -333,6 +435,35 @@ def test_add_pagination_links():
     add_pagination_links(dict(), 1000, qsm, str())
 
 
+def test_add_pagination_links_stable_order():
+    data = dict()
+    add_pagination_links(data, 45, QSManager({'sort': 'name', 'page[number]': '2', 'page[size]': '10'}, None),
+                         '/persons')
+    assert data['links'] == {
+        'self': '/persons?page%5Bsize%5D=10&sort=name&page%5Bnumber%5D=2',
+        'first': '/persons?page%5Bsize%5D=10&sort=name',
+        'last': '/persons?page%5Bsize%5D=10&sort=name&page%5Bnumber%5D=5',
+        'prev': '/persons?page%5Bsize%5D=10&sort=name&page%5Bnumber%5D=1',
+        'next': '/persons?page%5Bsize%5D=10&sort=name&page%5Bnumber%5D=3'
+    }
+
+    reordered = dict()
+    add_pagination_links(reordered, 45, QSManager({'page[size]': '10', 'page[number]': '2', 'sort': 'name'}, None),
+                         '/persons')
+    assert reordered == data
+
+    unpaginated = dict()
+    add_pagination_links(unpaginated, 45, QSManager({'page[size]': '0'}, None), '/persons')
+    assert unpaginated['links'] == {'self': '/persons?page%5Bsize%5D=0'}
+
+    first_page = dict()
+    add_pagination_links(first_page, 45, QSManager(dict(), None), '/persons')
+    assert first_page['links'] == {'self': '/persons',
+                                   'first': '/persons',
+                                   'last': '/persons?page%5Bnumber%5D=3',
+                                   'next': '/persons?page%5Bnumber%5D=2'}
+
+
 def test_Node(person_model, person_schema, monkeypatch):
     from copy import deepcopy
     filt = {
@@ -426,6 +557,31 @@ def test_compute_schema(person_schema):
     flask_rest_jsonapi.schema.compute_schema(person_schema, dict(only=list()), qsm, list())
 
 
+def test_compute_schema_included_data_deduplicated(app, register_routes, person_model, computer_model,
+                                                   person_schema, computer_schema, monkeypatch):
+    owner = person_model(person_id=1, name='test')
+    computers = [computer_model(id=i, serial=str(i), person=owner) for i in range(1, 4)]
+    dumped = []
+    dump = person_schema.dump
+
+    def dump_mock(self, obj, *args, **kwargs):
+        dumped.append(obj)
+        return dump(self, obj, *args, **kwargs)
+    monkeypatch.setattr(person_schema, 'dump', dump_mock)
+
+    with app.test_request_context():
+        qsm = QSManager(dict(), computer_schema)
+        schema = flask_rest_jsonapi.schema.compute_schema(computer_schema,
+                                                          dict(many=True),
+                                                          qsm,
+                                                          ['owner', 'owner.computers'])
+        result = schema.dump(computers).data
+
+    assert dumped == [owner]
+    assert sorted((item['type'], item['id']) for item in result['included']) == \
+        [('computer', '1'), ('computer', '2'), ('computer', '3'), ('person', '1')]
+
+
 # test good cases
 def test_get_list(client, register_routes, person, person_2):
     with client:
@@ -738,6 +894,145 @@ def test_wrong_content_type(client, register_routes):
         assert response.status_code == 415
 
 
+def test_exception_response(app, client, register_routes, monkeypatch):
+    with client:
+        response = client.get('/persons', content_type='application/vnd.api+json', headers={'Accept': 'error'})
+        assert response.headers['Content-Type'] == 'application/vnd.api+json'
+        assert json.loads(response.get_data())['errors'][0]['status'] == 406
+
+    monkeypatch.setitem(app.config, 'PROPOGATE_ERROR', False)
+    with app.app_context():
+        response = exception_response(ObjectNotFound({'parameter': 'id'}, 'Person: 1 not found'))
+        assert response.status_code == 404
+        assert json.loads(response.get_data()) == jsonapi_errors([{'status': 404,
+                                                                   'source': {'parameter': 'id'},
+                                                                   'title': 'Object not found',
+                                                                   'detail': 'Person: 1 not found'}])
+        for exc in (ObjectNotFound({'parameter': 'id'}, u'Person: "2\xe9" not found'),
+                    ObjectNotFound({'pointer': ''}, 'Object Not Found'),
+                    RelatedObjectNotFound('', 'Computer.id: 3 not found'),
+                    ObjectNotFound({'parameter': 'id'}, 'Person: 4 not found', title='Person not found'),
+                    ObjectNotFound({'pointer': ['id']}, 'Person: 5 not found')):
+            assert exception_response(exc).get_data() == serialize_errors([exc.to_dict()])
+        assert len(NOT_FOUND_TEMPLATES) >= 4
+        response = exception_response(ValueError('secret'))
+        assert response.status_code == 500
+        assert json.loads(response.get_data())['errors'][0]['detail'] == 'Unknown error'
+        monkeypatch.setitem(app.config, 'PROPOGATE_ERROR', True)
+        assert json.loads(exception_response(ValueError('secret')).get_data())['errors'][0]['detail'] == 'secret'
+
+
+def test_check_headers_before_request(app, register_routes):
+    with app.test_request_context('/persons', headers={'Accept': 'text/html'}):
+        response = app.preprocess_request()
+        assert response.status_code == 406
+    with app.test_request_context('/persons', method='POST', headers={'Content-Type': 'application/json'}):
+        assert app.preprocess_request().status_code == 415
+    with app.test_request_context('/persons', headers={'Accept': 'application/vnd.api+json'}):
+        assert app.preprocess_request() is None
+    with app.test_request_context('/unknown', headers={'Accept': 'text/html'}):
+        assert app.preprocess_request() is None
+    assert flask_rest_jsonapi.decorators.accept_cache['text/html'] is False
+
+
+def test_resource_dispatch(app, person_list, session, person_model, person_schema, monkeypatch):
+    monkeypatch.setitem(app.config, 'ETAG', False)
+    assert person_list._data_layer.resource is person_list
+    assert person_list._handlers['HEAD'] is person_list._handlers['GET']
+
+    def get(self, *args, **kwargs):
+        return {'data': None}, 201, {'X-Test': 'test'}
+    monkeypatch.setattr(person_list, 'get', get)
+    assert person_list._handlers['GET'] is get
+
+    class PersonSubList(person_list):
+        pass
+    monkeypatch.setattr(person_list, 'post', lambda self, *args, **kwargs: ({'data': None}, 202))
+    assert PersonSubList._data_layer is not person_list._data_layer
+    assert (PersonSubList._data_layer.resource, person_list._data_layer.resource) == (PersonSubList, person_list)
+    assert PersonSubList._data_layer.model is person_list._data_layer.model
+
+    with app.test_request_context('/persons', method='HEAD'):
+        response = PersonSubList().dispatch_request()
+        assert response.status_code == 201
+        assert response.headers['X-Test'] == 'test'
+        assert response.headers['Content-Type'] == 'application/vnd.api+json'
+        assert json.loads(response.get_data()) == {'data': None, 'jsonapi': {'version': '1.0'}}
+    with app.test_request_context('/persons', method='POST'):
+        assert PersonSubList().dispatch_request().status_code == 202
+
+    PersonSubList.get = lambda self, *args, **kwargs: {'data': []}
+    assert PersonSubList._handlers['GET'] is not get
+    del PersonSubList.get
+    assert PersonSubList._handlers['GET'] is get
+
+
+def test_resource_detail_last_modified(app, client, register_routes, session, person, person_detail, monkeypatch):
+    for key, value in (('DASHERIZE_API', False), ('PROPOGATE_ERROR', False), ('ETAG', True), ('SOFT_DELETE', False)):
+        monkeypatch.setitem(app.config, key, value)
+    monkeypatch.setattr(person_detail._data_layer, 'last_modified_field', 'birth_date', raising=False)
+    person.birth_date = datetime(2017, 1, 2, 3, 4, 5)
+    session.commit()
+    url = '/persons/' + str(person.person_id)
+    payload = {'data': {'type': 'person', 'id': str(person.person_id), 'attributes': {'name': 'modified'}}}
+
+    with client:
+        response = client.get(url, content_type='application/vnd.api+json')
+        assert response.status_code == 200
+        assert response.headers['Last-Modified'] == 'Mon, 02 Jan 2017 03:04:05 GMT'
+        etag = response.headers['ETag']
+
+        response = client.get(url, content_type='application/vnd.api+json',
+                              headers={'If-Modified-Since': 'Mon, 02 Jan 2017 03:04:05 GMT'})
+        assert response.status_code == 304
+        response = client.get(url, content_type='application/vnd.api+json',
+                              headers={'If-Modified-Since': 'Mon, 02 Jan 2017 03:04:04 GMT'})
+        assert response.status_code == 200
+        response = client.get(url, content_type='application/vnd.api+json',
+                              headers={'If-Modified-Since': 'Mon, 02 Jan 2017 03:04:04 GMT', 'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.headers['ETag'] == etag
+        response = client.get(url, content_type='application/vnd.api+json', headers={'If-Match': 'other'})
+        assert response.status_code == 412
+        assert (response.headers['ETag'], response.headers['Last-Modified']) == (etag, 'Mon, 02 Jan 2017 03:04:05 GMT')
+        assert response.headers['Content-Type'] == 'application/vnd.api+json'
+
+        response = client.patch(url, data=json.dumps(payload), content_type='application/vnd.api+json',
+                                headers={'If-Unmodified-Since': 'Sun, 01 Jan 2017 00:00:00 GMT'})
+        assert response.status_code == 412
+        response = client.delete(url, content_type='application/vnd.api+json',
+                                 headers={'If-Unmodified-Since': 'Sun, 01 Jan 2017 00:00:00 GMT'})
+        assert response.status_code == 412
+    session.refresh(person)
+    assert person.name == 'test'
+
+    # werkzeug removes entity headers like Last-Modified from 304 responses when they are sent
+    with app.test_request_context(url, headers={'If-Modified-Since': 'Mon, 02 Jan 2017 03:04:05 GMT'}):
+        response = person_detail().dispatch_request(person_id=person.person_id)
+        assert response.status_code == 304
+        assert response.headers['Last-Modified'] == 'Mon, 02 Jan 2017 03:04:05 GMT'
+        assert 'ETag' not in response.headers
+
+
+def test_resource_detail_patch_update_returning(app, client, register_routes, session, person, person_detail,
+                                                monkeypatch):
+    for key, value in (('DASHERIZE_API', False), ('PROPOGATE_ERROR', False), ('ETAG', False)):
+        monkeypatch.setitem(app.config, key, value)
+    monkeypatch.setattr(person_detail._data_layer, 'update_returning', True, raising=False)
+    url = '/persons/' + str(person.person_id)
+
+    with client:
+        payload = {'data': {'type': 'person', 'id': str(person.person_id)}}
+        response = client.patch(url, data=json.dumps(payload), content_type='application/vnd.api+json')
+        assert response.status_code == 200
+        assert json.loads(response.get_data())['data']['attributes']['name'] == 'test'
+
+        payload['data']['attributes'] = {'name': 'returned'}
+        response = client.patch(url, data=json.dumps(payload), content_type='application/vnd.api+json')
+        assert response.status_code == 200
+        assert json.loads(response.get_data())['data']['attributes']['name'] == 'returned'
+
+
 @pytest.fixture(scope="module")
 def wrong_data_layer():
     class WrongDataLayer(object):
@@ -995,6 +1290,807 @@ def test_sqlalchemy_data_layer_sort_query_error(session, person_model, monkeypat
         dl.sort_query(None, [dict(field='test')])
 
 
+def test_sqlalchemy_data_layer_get_relationship_linkage(session, person_model, computer_model, person_list,
+                                                        computer_list, person):
+    computers = [computer_model(serial=str(i), person=person) for i in range(3)]
+    session.add_all(computers)
+    session.commit()
+
+    dl = SqlalchemyDataLayer(dict(session=session, model=person_model, resource=person_list))
+    obj, data, related_count = dl.get_relationship_page('computers', 'computer', 'id', dict(id=person.person_id),
+                                                        {'size': '2', 'number': '2'})
+    assert obj is person
+    assert related_count == 3
+    assert data == [{'type': 'computer', 'id': computers[2].id}]
+    assert dl.get_relationship('computers', 'computer', 'id', dict(id=person.person_id)) == \
+        (person, [{'type': 'computer', 'id': computer_.id} for computer_ in computers])
+
+    related_objects = []
+
+    def after_get_relationship(self, obj, related_objects_, *args):
+        related_objects.append(related_objects_)
+    dl = SqlalchemyDataLayer(dict(session=session, model=computer_model, resource=computer_list,
+                                  methods={'after_get_relationship': after_get_relationship}))
+    obj, data = dl.get_relationship('person', 'person', 'person_id', dict(id=computers[0].id))
+    assert data == {'type': 'person', 'id': person.person_id}
+    assert related_objects == [person]
+
+    class ListDataLayer(BaseDataLayer):
+        def get_relationship(self, relationship_field, related_type_, related_id_field, view_kwargs):
+            return person, [{'type': 'computer', 'id': computer_.id} for computer_ in computers]
+    assert ListDataLayer(dict()).get_relationship_page('computers', 'computer', 'id', dict(),
+                                                       {'size': '2', 'number': '2'}) == \
+        (person, [{'type': 'computer', 'id': computers[2].id}], 3)
+
+    for computer_ in computers:
+        session.delete(computer_)
+    session.commit()
+
+
+def test_sqlalchemy_data_layer_get_last_modified(session, person_model, person_list, person):
+    person.birth_date = datetime(2017, 1, 2, 3, 4, 5, 678)
+    session.commit()
+
+    dl = SqlalchemyDataLayer(dict(session=session, model=person_model, resource=person_list,
+                                  last_modified_field='birth_date'))
+    assert dl.get_last_modified(dict(id=person.person_id)) == datetime(2017, 1, 2, 3, 4, 5, 678)
+    assert dl.get_last_modified(dict(id=person.person_id + 1000)) is None
+    assert flask_rest_jsonapi.resource.utc_datetime(datetime(2017, 1, 2, 3, 4, 5, 678, tzinfo=pytz.utc)) == \
+        datetime(2017, 1, 2, 3, 4, 5)
+
+
+def test_sqlalchemy_data_layer_update_relationship_diff(engine, session, person_model, computer_model, person_list,
+                                                       person, capture_statements):
+    computers = [computer_model(serial=str(i), person=person if i < 2 else None) for i in range(3)]
+    session.add_all(computers)
+    session.commit()
+
+    # related objects loaded in a session that doesn't expire them on commit are synchronized
+    session_ = sessionmaker(bind=engine, expire_on_commit=False)()
+    loaded_computers = [session_.query(computer_model).get(computer_.id) for computer_ in computers]
+    assert [computer_.person is not None for computer_ in loaded_computers] == [True, True, False]
+
+    dl = SqlalchemyDataLayer(dict(session=session_, model=person_model, resource=person_list))
+    payload = {'data': [{'type': 'computer', 'id': str(computers[1].id)},
+                        {'type': 'computer', 'id': str(computers[2].id)}]}
+    with capture_statements() as statements:
+        obj, updated = dl.update_relationship(payload, 'computers', 'id', dict(id=person.person_id))
+
+    assert updated is True
+    assert {computer_.id for computer_ in obj.computers} == {computers[1].id, computers[2].id}
+    assert len([statement for statement in statements if statement.startswith('UPDATE computer')]) == 2
+    assert [computer_.person_id for computer_ in loaded_computers] == [None, obj.person_id, obj.person_id]
+    assert [computer_.person for computer_ in loaded_computers] == [None, obj, obj]
+    session_.close()
+
+    with pytest.raises(RelatedObjectNotFound):
+        dl.update_relationship({'data': [{'type': 'computer', 'id': '0'}]}, 'computers', 'id',
+                               dict(id=person.person_id))
+
+    for computer_ in computers:
+        session.delete(computer_)
+    session.commit()
+
+
+def test_sqlalchemy_data_layer_delete_relationship_bulk(app, session, person_model, computer_model, person_list, person,
+                                                       capture_statements, monkeypatch):
+    monkeypatch.setitem(app.config, 'PROPOGATE_ERROR', False)
+    computers = [computer_model(serial=str(i), person=person) for i in range(3)]
+    session.add_all(computers)
+    session.commit()
+
+    dl = SqlalchemyDataLayer(dict(session=session, model=person_model, resource=person_list))
+    payload = {'data': [{'type': 'computer', 'id': str(computers[0].id)},
+                        {'type': 'computer', 'id': computers[1].id},
+                        {'type': 'computer', 'id': '0'}]}
+    with capture_statements() as statements:
+        obj, updated = dl.delete_relationship(payload, 'computers', 'id', dict(id=person.person_id))
+
+    assert updated is True
+    assert [computer_.id for computer_ in obj.computers] == [computers[2].id]
+    assert len([statement for statement in statements if statement.startswith('UPDATE computer')]) == 1
+
+    def remove_related_ids(obj, relationship_field, related_id_field, related_ids):
+        raise Exception('Connection lost')
+    dl.remove_related_ids = remove_related_ids
+    with app.app_context():
+        with pytest.raises(JsonApiException) as excinfo:
+            dl.delete_relationship({'data': [{'type': 'computer', 'id': computers[2].id}]}, 'computers', 'id',
+                                   dict(id=person.person_id))
+    assert excinfo.value.detail == 'Delete relationship error'
+
+    for computer_ in computers:
+        session.delete(computer_)
+    session.commit()
+
+
+def test_sqlalchemy_data_layer_update_relationship_association_table(app, engine, session, person_model, group_model,
+                                                                     person, person_2, monkeypatch):
+    monkeypatch.setitem(app.config, 'PROPOGATE_ERROR', False)
+    class GroupSchema(Schema):
+        class Meta:
+            type_ = 'group'
+        id = fields.Str(dump_only=True)
+        members = Relationship(type_='person', many=True)
+
+    member = person_model(name='member')
+    group = group_model(members=[person, person_2])
+    session.add_all([group, member])
+    session.commit()
+    group_id, member_ids = group.id, [person.person_id, person_2.person_id, member.person_id]
+
+    session_ = sessionmaker(bind=engine, expire_on_commit=False)()
+    loaded_members = [session_.query(person_model).get(member_id) for member_id in member_ids]
+    assert [len(member_.groups) for member_ in loaded_members] == [1, 1, 0]
+
+    resource = type('resource', (object,), dict(schema=GroupSchema))
+    dl = SqlalchemyDataLayer(dict(session=session_, model=group_model, resource=resource))
+    payload = {'data': [{'type': 'person', 'id': str(member_ids[1])}, {'type': 'person', 'id': str(member_ids[2])}]}
+    obj, updated = dl.update_relationship(payload, 'members', 'person_id', dict(id=group_id))
+
+    assert updated is True
+    assert sorted(member_.person_id for member_ in obj.members) == member_ids[1:]
+    assert sorted(session_.execute(group_model.members.property.secondary.select()
+                                   .where(text('group_id = {}'.format(group_id)))).fetchall()) == \
+        [(group_id, member_ids[1]), (group_id, member_ids[2])]
+    assert [member_.groups for member_ in loaded_members] == [[], [obj], [obj]]
+
+    # identifiers sent as integers are compared with the identifiers of the related objects as strings
+    payload = {'data': [{'type': 'person', 'id': member_ids[1]}, {'type': 'person', 'id': member_ids[2]}]}
+    assert dl.update_relationship(payload, 'members', 'person_id', dict(id=group_id))[1] is False
+
+    def remove_related_ids(obj, relationship_field, related_id_field, related_ids):
+        raise Exception('Connection lost')
+    dl.remove_related_ids = remove_related_ids
+    with app.app_context():
+        with pytest.raises(JsonApiException) as excinfo:
+            dl.update_relationship({'data': [{'type': 'person', 'id': str(member_ids[1])}]}, 'members', 'person_id',
+                                   dict(id=group_id))
+    assert excinfo.value.detail == 'Update relationship error'
+    assert not session_.dirty and not session_.new
+    session_.close()
+
+    session.delete(group)
+    session.delete(member)
+    session.commit()
+
+
+def test_sqlalchemy_data_layer_update_object_version(session, document_model):
+    class DocumentSchema(Schema):
+        class Meta:
+            type_ = 'document'
+        id = fields.Str(dump_only=True)
+        title = fields.Str()
+        version = fields.Integer()
+
+    session.add(document_model(id=1, title='draft'))
+    session.commit()
+
+    resource = type('resource', (object,), dict(schema=DocumentSchema))
+    dl = SqlalchemyDataLayer(dict(session=session, model=document_model, resource=resource,
+                                  concurrency_field='version'))
+    obj = dl.get_object(dict(id=1))
+    dl.update_object(obj, {'title': 'final', 'version': 1}, dict(id=1))
+    assert (obj.title, obj.version) == ('final', 2)
+
+    with pytest.raises(PreconditionFailed):
+        dl.update_object(dl.get_object(dict(id=1)), {'title': 'stale', 'version': 1}, dict(id=1))
+    assert session.query(document_model.title, document_model.version).one() == ('final', 2)
+
+    dl.update_object(dl.get_object(dict(id=1)), {'title': 'unversioned'}, dict(id=1))
+    assert session.query(document_model.title, document_model.version).one() == ('unversioned', 3)
+
+    # a payload with the version only checks it
+    dl = SqlalchemyDataLayer(dict(session=session, model=document_model, resource=resource, concurrency_field='title'))
+    dl.update_object(dl.get_object(dict(id=1)), {'title': 'unversioned'}, dict(id=1))
+    with pytest.raises(PreconditionFailed):
+        dl.update_object(dl.get_object(dict(id=1)), {'title': 'final'}, dict(id=1))
+    assert session.query(document_model.title, document_model.version).one() == ('unversioned', 3)
+
+    session.delete(session.query(document_model).get(1))
+    session.commit()
+
+
+def test_sqlalchemy_data_layer_update_object_returning(session, person_model, person_list, person,
+                                                      capture_statements):
+    person_id = person.person_id
+
+    dl = SqlalchemyDataLayer(dict(session=session, model=person_model, resource=person_list))
+    with capture_statements() as statements:
+        obj = dl.update_object_returning({'name': 'renamed'}, dict(id=person_id))
+
+    assert obj is person and obj.name == 'renamed'
+    assert statements[0].startswith('UPDATE person')
+    assert dl.update_object_returning({'name': 'renamed'}, dict(id=person_id + 1000)) is None
+
+    # the before_update_object additional method receives the loaded object
+    def before_update_object(self, obj, data, view_kwargs):
+        data['name'] = obj.name + ' again'
+    dl = SqlalchemyDataLayer(dict(session=session, model=person_model, resource=person_list,
+                                  methods={'before_update_object': before_update_object}))
+    with capture_statements() as statements:
+        obj = dl.update_object_returning({'name': 'renamed'}, dict(id=person_id))
+    assert obj.name == 'renamed again'
+    assert statements[0].startswith('SELECT')
+
+
+def test_sqlalchemy_data_layer_commit_object(app, register_routes, engine, session, person_model, person_list, person,
+                                             person_schema, capture_statements):
+    dl = SqlalchemyDataLayer(dict(session=session, model=person_model, resource=person_list))
+    obj = dl.get_object(dict(id=person.person_id))
+    dl.update_object(obj, {'name': 'renamed'}, dict(id=person.person_id))
+
+    with app.test_request_context():
+        with capture_statements() as statements:
+            result = person_schema(only=('id', 'name', 'birth_date')).dump(obj).data
+    assert result['data']['attributes'] == {'name': 'renamed', 'birth_date': None}
+    assert statements == []
+
+    # values generated by the database are loaded on access
+    local_base = declarative_base()
+
+    class Note(local_base):
+        __tablename__ = 'note'
+        id = Column(Integer, primary_key=True)
+        title = Column(String)
+        body = Column(String)
+        created_at = Column(DateTime, server_default=text("'2017-01-01 00:00:00.000000'"))
+        updated_at = Column(DateTime, server_onupdate=FetchedValue())
+
+    class NoteSchema(Schema):
+        class Meta:
+            type_ = 'note'
+        id = fields.Str(dump_only=True)
+        title = fields.Str()
+
+    local_base.metadata.create_all(engine)
+    session.execute(text("CREATE TRIGGER note_updated AFTER UPDATE OF title ON note BEGIN "
+                         "UPDATE note SET updated_at = '2017-01-02 00:00:00.000000' WHERE id = NEW.id; END"))
+    session.commit()
+
+    resource = type('resource', (object,), dict(schema=NoteSchema))
+    dl = SqlalchemyDataLayer(dict(session=session, model=Note, resource=resource))
+    with capture_statements() as statements:
+        note = dl.create_object({'title': 'draft'}, dict())
+        assert (note.title, note.body) == ('draft', None)
+    assert not any(statement.startswith('SELECT') for statement in statements)
+    assert note.created_at == datetime(2017, 1, 1)
+
+    dl.update_object(note, {'title': 'final'}, dict(id=note.id))
+    with capture_statements() as statements:
+        assert (note.title, note.body, note.created_at) == ('final', None, datetime(2017, 1, 1))
+    assert statements == []
+    assert note.updated_at == datetime(2017, 1, 2)
+
+    session.close()
+    local_base.metadata.drop_all(engine)
+
+
+def test_sqlalchemy_data_layer_write_collection(app, session, person_model, tag_model, person_list, person_schema,
+                                                monkeypatch, capture_statements):
+    monkeypatch.setitem(app.config, 'DASHERIZE_API', False)
+    session.add_all([person_model(name='bulk') for i in range(5)])
+    session.commit()
+
+    dl = SqlalchemyDataLayer(dict(session=session, model=person_model, resource=person_list, batch_size=2))
+    qs = QSManager({'filter': json.dumps([{'name': 'name', 'op': 'eq', 'val': 'bulk'}])}, person_schema)
+    with app.app_context():
+        assert dl.update_collection(qs, dict(), {'birth_date': datetime(2017, 1, 1)}) == 5
+        assert session.query(person_model).filter_by(birth_date=datetime(2017, 1, 1)).count() == 5
+        assert dl.delete_collection(qs, dict()) == 5
+    assert session.query(person_model).filter_by(name='bulk').count() == 0
+
+    # composite primary keys are written by batches too
+    session.add_all([tag_model(article_id=article_id, name=name) for article_id in (1, 2) for name in 'ab'] +
+                    [tag_model(article_id=3, name='a')])
+    session.commit()
+    dl = SqlalchemyDataLayer(dict(session=session, model=tag_model, resource=person_list, batch_size=2))
+    with app.app_context():
+        with capture_statements() as statements:
+            assert dl.update_collection(QSManager({}, person_schema), dict(), {'label': 'bulk'}) == 5
+        assert len([statement for statement in statements if statement.startswith('UPDATE tag')]) == 3
+        assert session.query(tag_model).filter_by(label='bulk').count() == 5
+        assert dl.delete_collection(QSManager({}, person_schema), dict()) == 5
+    assert session.query(tag_model).count() == 0
+
+
+def test_resource_list_bulk_operations(session, article_model):
+    class ArticleSchema(Schema):
+        class Meta:
+            type_ = 'article'
+        id = fields.Str(dump_only=True)
+        title = fields.Str()
+        deleted_at = fields.DateTime()
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+
+        class ArticleList(ResourceList):
+            schema = ArticleSchema
+            bulk_operations = True
+            data_layer = {'session': session,
+                          'model': article_model,
+                          'batch_size': 2}
+
+    app_ = Flask(__name__)
+    app_.config.update(DASHERIZE_API=False, PROPOGATE_ERROR=False, ETAG=False, SOFT_DELETE=True)
+    api = Api(app_)
+    api.route(ArticleList, 'article_list', '/articles')
+    session.add_all([article_model(title='bulk') for i in range(3)] + [article_model(title='other')])
+    session.commit()
+
+    def request(method, **querystring):
+        querystring.setdefault('filter', json.dumps([{'name': 'title', 'op': 'eq', 'val': 'bulk'}]))
+        querystring = {key: value for key, value in querystring.items() if value is not None}
+        with app_.test_client() as client:
+            response = client.open('/articles?' + urlencode(querystring), method=method,
+                                   content_type='application/vnd.api+json')
+        return response.status_code, json.loads(response.get_data())
+
+    def count(title, deleted):
+        deleted_filter = article_model.deleted_at.isnot(None) if deleted else article_model.deleted_at.is_(None)
+        return session.query(article_model).filter(article_model.title == title, deleted_filter).count()
+
+    assert request('DELETE', filter=None)[1]['errors'][0]['detail'] == \
+        'Filters are required to delete objects of a collection'
+    assert request('PATCH')[1]['errors'][0]['detail'] == 'Only the restore of soft deleted objects is supported'
+    assert request('DELETE') == (200, {'meta': {'message': 'Objects successfully deleted', 'count': 3},
+                                       'jsonapi': {'version': '1.0'}})
+    assert (count('bulk', True), count('other', False)) == (3, 1)
+    assert request('PATCH', restore='true')[1]['meta']['count'] == 3
+    assert count('bulk', False) == 3
+
+    assert request('DELETE')[1]['meta']['count'] == 3
+    assert request('DELETE', purge='true', filter=None)[1]['meta']['count'] == 3
+    assert session.query(article_model).filter_by(title='bulk').count() == 0
+    assert request('DELETE', permanent='true', filter=json.dumps([{'name': 'title', 'op': 'eq', 'val': 'other'}]))[1] \
+        ['meta']['count'] == 1
+    assert session.query(article_model).count() == 0
+
+
+def test_sqlalchemy_data_layer_check_soft_delete_index(article_model, comment_model):
+    with pytest.warns(UserWarning):
+        SqlalchemyDataLayer(dict(session=None, model=article_model)).check_soft_delete_index()
+
+    with warnings.catch_warnings(record=True) as record:
+        warnings.simplefilter('always')
+        dl = SqlalchemyDataLayer(dict(session=None, model=comment_model))
+        dl.check_soft_delete_index()
+    assert not record
+    assert dl.get_soft_delete_predicates() is dl.get_soft_delete_predicates()
+    assert str(dl.get_soft_delete_predicates()[False]) == 'comment.deleted_at IS NULL'
+
+    deleted_at = comment_model.__table__.c.deleted_at
+    assert is_not_deleted_predicate(deleted_at.is_(None), deleted_at)
+    assert is_not_deleted_predicate(text('( "deleted_at"  IS NULL )'), deleted_at)
+    assert not is_not_deleted_predicate(deleted_at.isnot(None), deleted_at)
+    assert not is_not_deleted_predicate(text('deleted_at IS NOT NULL'), deleted_at)
+    assert not is_not_deleted_predicate(comment_model.__table__.c.id.is_(None), deleted_at)
+
+
+def test_sqlalchemy_data_layer_statement_timeout(session, person_model, person_list):
+    slow_query = text("WITH RECURSIVE counter(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM counter) "
+                      "SELECT count(*) FROM (SELECT x FROM counter LIMIT :limit)")
+
+    dl = SqlalchemyDataLayer(dict(session=session, model=person_model, resource=person_list,
+                                  statement_timeout={'GET': 0.05}))
+    with pytest.raises(QueryTimeout):
+        with dl.statement_timeout_context('GET'):
+            session.execute(slow_query, {'limit': 100000000})
+
+    with pytest.raises(QueryTimeout):
+        with dl.statement_timeout_context('GET'):
+            try:
+                session.execute(slow_query, {'limit': 100000000})
+            except Exception:
+                raise JsonApiException('', "Update object error")
+
+    # other errors raised after the deadline are not timeouts
+    with pytest.raises(DBAPIError):
+        with dl.statement_timeout_context('GET'):
+            time.sleep(0.06)
+            session.execute(text("SELECT * FROM missing_table"))
+    session.rollback()
+
+    class QueryCanceled(Exception):
+        pgcode = '57014'
+    assert is_statement_timeout(DBAPIError('SELECT 1', {}, QueryCanceled()))
+    assert not is_statement_timeout(DBAPIError('SELECT 1', {}, Exception()))
+
+    with dl.statement_timeout_context('PATCH'):
+        assert session.execute(text("SELECT 1")).scalar() == 1
+    assert session.execute(slow_query, {'limit': 100000}).scalar() == 100000
+
+
+def test_sqlalchemy_data_layer_read_session(app, tmpdir, person_model, person_list, base):
+    sessions = []
+    for name in ('primary', 'replica'):
+        engine_ = create_engine("sqlite:///{}".format(tmpdir.join(name + '.db')))
+        base.metadata.create_all(engine_)
+        session_ = sessionmaker(bind=engine_)()
+        session_.add(person_model(person_id=1, name=name))
+        session_.commit()
+        sessions.append(session_)
+    primary, replica = sessions
+
+    dl = SqlalchemyDataLayer(dict(session=primary, read_session=replica, resource=person_list, model=person_model,
+                                  sticky_window=60))
+    with app.test_request_context(method='GET'):
+        assert dl.get_object(dict(id=1)).name == 'replica'
+    with app.test_request_context(method='PATCH'):
+        obj = dl.get_object(dict(id=1))
+        assert obj.name == 'primary'
+        dl.update_object(obj, {'name': 'updated'}, dict(id=1))
+        response = set_sticky_cookie(app.response_class())
+    cookie = response.headers['Set-Cookie'].split(';')[0]
+    assert cookie.startswith('jsonapi_sticky_until=')
+    with app.test_request_context(method='GET', headers={'Cookie': cookie}):
+        assert dl.get_collection(QSManager({}, person_list.schema), dict())[1][0].name == 'updated'
+    with app.test_request_context(method='GET'):
+        assert dl.get_collection(QSManager({}, person_list.schema), dict())[1][0].name == 'replica'
+        dl.replica_lag = lambda read_session: 10
+        assert dl.get_object(dict(id=1)).name == 'updated'
+
+
+def test_sqlalchemy_data_layer_session_factory(base, person_model, person_list):
+    engine_ = create_engine("sqlite://")
+    base.metadata.create_all(engine_)
+    factory = sessionmaker(bind=engine_)
+    app_ = Flask(__name__)
+    Api(app_)
+
+    dl = SqlalchemyDataLayer(dict(session=factory, model=person_model, resource=person_list))
+    dl_2 = SqlalchemyDataLayer(dict(session=factory, model=person_model, resource=person_list))
+    with app_.app_context():
+        session_ = dl.session
+        assert dl.session is session_ and dl_2.session is session_
+        assert dl.get_pool_metrics()['checked_out'] == 1
+    metrics = dl.get_pool_metrics()
+    assert (metrics['sessions'], metrics['checkouts'], metrics['checked_out']) == (1, 1, 0)
+
+    with app_.app_context():
+        assert dl.session is not session_
+    with pytest.raises(Exception):
+        dl.session
+
+    # sessions bound to a connection report the metrics of its engine
+    connection = engine_.connect()
+    dl_3 = SqlalchemyDataLayer(dict(session=sessionmaker(bind=connection), model=person_model, resource=person_list))
+    with app_.app_context():
+        assert dl_3.session.bind is connection
+        assert dl_3.get_pool_metrics()['checked_out'] == 1
+    assert dl_3.get_pool_metrics()['sessions'] == 3
+    connection.close()
+    del dl_3, connection
+
+    engine_ref = weakref.ref(engine_)
+    del dl, dl_2, factory, session_, engine_
+    gc.collect()
+    assert engine_ref() is None
+
+
+def test_resource_cache(app, person_schema):
+    cache = ResourceCache(max_entries=2)
+    cache.register('person')
+    schema = person_schema()
+    persons = [type('person', (object,), dict(person_id=i))() for i in range(3)]
+    for person_ in persons:
+        cache.set(cache.key(schema, person_), {'type': 'person', 'id': str(person_.person_id)})
+
+    assert cache.get(cache.key(schema, persons[0])) is None
+    assert cache.get(cache.key(schema, persons[1])) == {'type': 'person', 'id': '1'}
+    cache.invalidate('person', 1)
+    assert cache.get(cache.key(schema, persons[1])) is None
+    assert cache.get(cache.key(schema, persons[2])) == {'type': 'person', 'id': '2'}
+    cache.invalidate('person')
+    assert not cache.entries and not cache.index and cache.memory == 0
+
+    cache = ResourceCache(max_memory=100)
+    cache.register('person')
+    cache.set(cache.key(schema, persons[0]), {'type': 'person', 'id': '0', 'attributes': {'name': 'x' * 10}})
+    cache.set(cache.key(schema, persons[1]), {'type': 'person', 'id': '1', 'attributes': {'name': 'x' * 10}})
+    assert len(cache.entries) == 1 and cache.memory <= 100
+
+    computer_schema_ = type('schema', (object,), dict(opts=type('opts', (object,), dict(type_='computer'))))
+    assert cache.key(computer_schema_, persons[0]) is None
+
+    with app.test_request_context(base_url='http://localhost/prefix/'):
+        prefixed_key = cache.key(schema, persons[0])
+    with app.test_request_context(base_url='http://example.com/'):
+        assert cache.key(schema, persons[0]) != prefixed_key
+        linkage_schema = person_schema()
+        linkage_schema.fields['computers'].include_resource_linkage = True
+        assert cache.key(linkage_schema, persons[0]) != cache.key(schema, persons[0])
+
+
+def test_sqlalchemy_data_layer_sort_relationship(app, session, person_model, computer_model, computer_list,
+                                                 person_schema, computer_schema, monkeypatch):
+    monkeypatch.setitem(app.config, 'DASHERIZE_API', False)
+    owners = [person_model(name=name) for name in ('b', 'a')]
+    computers = [computer_model(serial='sort', person=owner) for owner in owners]
+    session.add_all(computers)
+    session.commit()
+
+    dl = SqlalchemyDataLayer(dict(session=session, model=computer_model, resource=computer_list))
+    qs = QSManager({'sort': 'owner.name,-serial',
+                    'filter': json.dumps([{'name': 'serial', 'op': 'eq', 'val': 'sort'}])}, computer_schema)
+    with app.app_context():
+        assert qs.sorting == [{'field': 'person.name', 'order': 'asc'}, {'field': 'serial', 'order': 'desc'}]
+        assert str(dl.sort_query(session.query(computer_model), qs.sorting)).count('JOIN') == 1
+        assert dl.get_collection(qs, dict())[1] == computers[::-1]
+        with pytest.raises(InvalidSort):
+            QSManager({'sort': 'owner.computers'}, computer_schema).sorting
+        with pytest.raises(InvalidSort):
+            QSManager({'sort': 'serial.name'}, computer_schema).sorting
+        assert computer_schema._declared_fields['owner'].__dict__['_Relationship__schema'] == 'PersonSchema'
+
+        class OwnerWithoutSchema(Schema):
+            class Meta:
+                type_ = 'computer'
+            owner = Relationship(attribute='person', type_='person')
+        with pytest.raises(InvalidSort):
+            QSManager({'sort': 'owner.name'}, OwnerWithoutSchema).sorting
+
+        dl.sortable_fields = ['serial']
+        with pytest.raises(InvalidSort):
+            dl.get_collection(qs, dict())
+
+    with pytest.warns(UserWarning):
+        dl.check_sortable_fields()
+    dl.sortable_fields = ['id', 'person.person_id']
+    with warnings.catch_warnings(record=True) as record:
+        warnings.simplefilter('always')
+        dl.check_sortable_fields()
+    assert not record
+    dl.sortable_fields = ['person.unknown']
+    with pytest.raises(Exception):
+        dl.check_sortable_fields()
+
+    for computer_ in computers:
+        session.delete(computer_)
+    for owner in owners:
+        session.delete(owner)
+    session.commit()
+
+
+def test_sqlalchemy_data_layer_default_sort(session, person_model, article_model):
+    dl = SqlalchemyDataLayer(dict(session=session, model=person_model))
+    assert str(dl.sort_query(session.query(person_model), [])).endswith('ORDER BY person.person_id ASC')
+    query = dl.sort_query(session.query(person_model), [{'field': 'name', 'order': 'desc'}])
+    assert str(query).endswith('ORDER BY person.name DESC, person.person_id DESC')
+    query = dl.sort_query(session.query(person_model), [{'field': 'person_id', 'order': 'desc'}])
+    assert str(query).endswith('ORDER BY person.person_id DESC')
+
+    with warnings.catch_warnings(record=True) as record:
+        warnings.simplefilter('always')
+        SqlalchemyDataLayer(dict(session=None, model=article_model,
+                                 default_sort=[{'field': 'created_at', 'order': 'desc'}])).check_default_sort()
+    assert not record
+    with pytest.warns(UserWarning):
+        SqlalchemyDataLayer(dict(session=None, model=article_model,
+                                 default_sort=[{'field': 'title', 'order': 'asc'}])).check_default_sort()
+
+
+def test_sqlalchemy_data_layer_get_aggregates(app, session, person_model, person_list, person_schema, monkeypatch,
+                                              capture_statements):
+    monkeypatch.setitem(app.config, 'DASHERIZE_API', False)
+    persons = [person_model(name=name, birth_date=datetime(2017, 1, day)) for name, day in
+               (('aggregate_a', 1), ('aggregate_a', 2), ('aggregate_b', 3))]
+    session.add_all(persons)
+    session.commit()
+
+    dl = SqlalchemyDataLayer(dict(session=session, model=person_model, resource=person_list))
+    qs = QSManager({'aggregate[count]': '*', 'aggregate[max]': 'birth_date', 'group[by]': 'name',
+                    'filter': json.dumps([{'name': 'name', 'op': 'like', 'val': 'aggregate_%'}])}, person_schema)
+    with app.app_context():
+        with capture_statements() as statements:
+            assert dl.get_aggregates(qs, dict()) == [
+                {'group': {'name': 'aggregate_a'}, 'count': {'*': 2}, 'max': {'birth_date': '2017-01-02T00:00:00'}},
+                {'group': {'name': 'aggregate_b'}, 'count': {'*': 1}, 'max': {'birth_date': '2017-01-03T00:00:00'}}]
+        assert len(statements) == 1 and 'GROUP BY person.name' in statements[0]
+        assert dl.get_aggregates(QSManager({'aggregate[count]': '*'}, person_schema), dict()) == \
+            [{'count': {'*': session.query(person_model).count()}}]
+        for count in ('*,birth_date', 'birth_date,*'):
+            qs = QSManager({'aggregate[count]': count, 'group[by]': 'name', 'page[size]': '1', 'page[number]': '2',
+                            'filter': json.dumps([{'name': 'name', 'op': 'like', 'val': 'aggregate_%'}])},
+                           person_schema)
+            assert dl.get_aggregates(qs, dict()) == [{'group': {'name': 'aggregate_b'},
+                                                      'count': {'*': 1, 'birth_date': 1}}]
+        with pytest.raises(InvalidAggregate):
+            QSManager({'aggregate[median]': 'birth_date'}, person_schema).aggregates
+        with pytest.raises(BadRequest):
+            QSManager({'group[by]': 'computers'}, person_schema).group_by
+
+    for person_ in persons:
+        session.delete(person_)
+    session.commit()
+
+
+def test_sqlalchemy_data_layer_full_text_search(app, session, person_model, person_list, person_schema,
+                                                monkeypatch):
+    monkeypatch.setitem(app.config, 'DASHERIZE_API', False)
+    persons = [person_model(name=name) for name in ('search alpha beta gamma', 'search alpha', 'search beta')]
+    session.add_all(persons)
+    session.commit()
+    session.execute(text("CREATE VIRTUAL TABLE person_fts "
+                         "USING fts5(name, content='person', content_rowid='person_id')"))
+    session.execute(text("INSERT INTO person_fts(person_fts) VALUES('rebuild')"))
+
+    dl = SqlalchemyDataLayer(dict(session=session, model=person_model, resource=person_list,
+                                  search={'fields': ['name']}))
+    monkeypatch.setattr(person_list, '_data_layer', dl)
+    qs = QSManager({'filter': json.dumps([{'op': 'search', 'val': 'alpha "search'}]), 'sort': '-relevance'},
+                   person_schema)
+    with app.app_context():
+        assert dl.get_collection(qs, dict())[1] == [persons[1], persons[0]]
+        qs = QSManager({'sort': 'relevance'}, person_schema)
+        with pytest.raises(InvalidSort):
+            dl.get_collection(qs, dict())
+        qs = QSManager({'filter': json.dumps([{'op': 'search', 'val': u'caf\xe9'}])}, person_schema)
+        assert dl.get_collection(qs, dict()) == (0, [])
+        for value in (42, ' ', None):
+            qs = QSManager({'filter': json.dumps([{'op': 'search', 'val': value}])}, person_schema)
+            with pytest.raises(InvalidFilters):
+                dl.get_collection(qs, dict())
+
+    condition = FullTextSearch(person_model, {'fields': ['name']}, '50%_off').compile()
+    assert "LIKE" in str(condition) and "ESCAPE" in str(condition)
+    assert list(condition.params.values()) == ['%50\\%\\_off%']
+
+    session.execute(text("DROP TABLE person_fts"))
+    for person_ in persons:
+        session.delete(person_)
+    session.commit()
+
+
+def test_compiled_serializer(app, register_routes, session, person, person_2, person_schema, computer_schema):
+    serializer = CompiledSerializer(person_schema)
+    assert serializer.compiled is True
+    with app.test_request_context():
+        persons = [person, person_2]
+        for person_ in persons:
+            session.expire(person_, ['computers'])
+        assert json.dumps(serializer.dump(persons)) == json.dumps(person_schema(many=True).dump(persons).data)
+        sparse_schema = person_schema(many=True)
+        sparse_schema.only = ('id', 'name')
+        assert serializer.dump(persons, sparse_schema) == sparse_schema.dump(persons).data
+
+    class TaggedSchema(Schema):
+        class Meta:
+            type_ = 'tagged'
+        id = fields.Str()
+
+        def format_item(self, item):
+            return dict(super(TaggedSchema, self).format_item(item), meta={'tagged': True})
+
+    assert CompiledSerializer(computer_schema).compiled is True
+    assert CompiledSerializer(TaggedSchema).compiled is False
+
+    class PersonWithoutNameSchema(Schema):
+        class Meta:
+            type_ = 'person'
+        id = fields.Str(dump_only=True, attribute='person_id')
+        name = fields.Str(load_only=True)
+        birth_date = fields.DateTime()
+
+    serializer = CompiledSerializer(PersonWithoutNameSchema)
+    assert serializer.compiled is True and serializer.attributes == {'person_id', 'birth_date'}
+    with app.test_request_context():
+        assert serializer.dump([person, person_2]) == PersonWithoutNameSchema(many=True).dump([person, person_2]).data
+
+
+def test_sqlalchemy_data_layer_read_only(app, register_routes, session, person, person_2, person_model,
+                                         person_schema, monkeypatch, capture_statements):
+    monkeypatch.setitem(app.config, 'DASHERIZE_API', False)
+
+    class PersonRowList(ResourceList):
+        schema = person_schema
+        compiled_serializer = True
+        data_layer = {'session': session,
+                      'model': person_model,
+                      'read_only': True}
+
+    dl = PersonRowList()._data_layer
+    qs = QSManager({'sort': 'name',
+                    'filter': json.dumps([{'name': 'id', 'op': 'in_', 'val': [person.person_id, person_2.person_id]}])},
+                   person_schema)
+    with app.test_request_context():
+        count, rows = dl.get_collection(qs, dict())
+        assert count == 2
+        assert [row.name for row in rows] == ['test', 'test2']
+        assert not any(isinstance(row, person_model) for row in rows)
+        assert PersonRowList._serializer.dump(rows) == PersonRowList._serializer.dump([person, person_2])
+
+        qs_include = QSManager(dict(qs.qs, include='computers'), person_schema)
+        assert isinstance(dl.get_collection(qs_include, dict())[1][0], person_model)
+        dl.after_get_collection = lambda collection, qs, view_kwargs: None
+        assert isinstance(dl.get_collection(qs, dict())[1][0], person_model)
+
+    class PersonWithoutNameSchema(Schema):
+        class Meta:
+            type_ = 'person'
+        id = fields.Str(dump_only=True, attribute='person_id')
+        name = fields.Str(load_only=True)
+        birth_date = fields.DateTime()
+
+    class PersonWithoutNameList(ResourceList):
+        schema = PersonWithoutNameSchema
+        compiled_serializer = True
+        data_layer = {'session': session,
+                      'model': person_model,
+                      'read_only': True}
+
+    dl = PersonWithoutNameList()._data_layer
+    with app.test_request_context():
+        with capture_statements() as statements:
+            rows = dl.get_collection(qs, dict())[1]
+        assert 'person.name AS name' not in statements[-1] and 'person.birth_date AS birth_date' in statements[-1]
+        assert [sorted(row.keys()) for row in rows] == [['birth_date', 'person_id']] * 2
+        assert all('name' not in item['attributes'] for item in PersonWithoutNameList._serializer.dump(rows)['data'])
+
+        qs_sparse = QSManager(dict(qs.qs, **{'fields[person]': 'id'}), PersonWithoutNameSchema)
+        assert [row.keys() for row in dl.get_collection(qs_sparse, dict())[1]] == [['person_id']] * 2
+
+
+def test_link_templates(app, client, register_routes, session, computer, person, computer_schema, monkeypatch):
+    monkeypatch.setitem(app.config, 'DASHERIZE_API', False)
+    monkeypatch.setitem(app.config, 'PROPOGATE_ERROR', False)
+    monkeypatch.setitem(app.config, 'ETAG', False)
+    computer.person = person
+    session.commit()
+
+    for base_url in ('http://localhost/', 'http://localhost/prefix/'):
+        with app.test_request_context(base_url=base_url):
+            assert get_link_template('api.person_detail', ('person_id',)).template == '/persons/{person_id}'
+            for endpoint, kwargs in (('api.person_detail', {'person_id': person.person_id}),
+                                     ('api.person_detail', {'person_id': str(person.person_id)}),
+                                     ('api.computer_list', {'person_id': person.person_id}),
+                                     ('api.person_list', dict())):
+                assert build_link(endpoint, **kwargs) == url_for(endpoint, **kwargs)
+
+    app_ = Flask('link_templates')
+    app_.config['APPLICATION_ROOT'] = '/api'
+    app_.add_url_rule('/persons/<int:person_id>', 'person', lambda person_id: None)
+    app_.add_url_rule('/files/<path:path>', 'file', lambda path: None)
+    app_.add_url_rule('/prices/<float:price>', 'price', lambda price: None)
+    app_.add_url_rule('/codes/<int(fixed_digits=4):code>', 'code', lambda code: None)
+    with app_.test_request_context(base_url='http://localhost/api/'):
+        assert get_link_template('person', ('person_id',)).template == '/persons/{person_id}'
+        assert get_link_template('file', ('path',)).template == '/files/{path}'
+        assert get_link_template('price', ('price',)).template is None
+        assert get_link_template('code', ('code',)).template is None
+        for endpoint, kwargs in (('person', {'person_id': 1}), ('file', {'path': 'a b/c'}), ('price', {'price': 2.5}),
+                                 ('code', {'code': 5})):
+            assert build_link(endpoint, **kwargs) == url_for(endpoint, **kwargs)
+        assert build_link('person', person_id=1) == '/api/persons/1'
+        assert build_link('price', price=2.5) == '/api/prices/2.5'
+        assert build_link('code', code=5) == '/api/codes/0005'
+    with app.test_request_context():
+        assert get_link_template('api.computer_list', ('person_id',)).template is None
+
+    related_view_kwargs = dict(computer_schema._declared_fields['owner'].related_view_kwargs)
+    with client:
+        response = client.get('/computers/' + str(computer.id) + '/relationships/owner',
+                              content_type='application/vnd.api+json')
+        assert response.status_code == 200
+        assert json.loads(response.get_data())['links']['related'] == '/persons/' + str(person.person_id)
+    assert computer_schema._declared_fields['owner'].related_view_kwargs == related_view_kwargs
+
+
+def test_sqlalchemy_data_layer_invalidate_cache(session, person_model, person_list, person):
+    cache = ResourceCache()
+    cache.register('person')
+    cache.register('computer')
+    cache.set(('person', str(person.person_id), None, None), {'type': 'person'})
+    cache.set(('computer', '1', None, None), {'type': 'computer'})
+    dl = SqlalchemyDataLayer(dict(session=session, model=person_model, resource=person_list, cache=cache))
+    dl.update_object(person, {'name': 'test2'}, dict())
+    assert ('person', str(person.person_id), None, None) not in cache.entries
+    assert ('computer', '1', None, None) in cache.entries
+    dl.invalidate_cache(person, ['computers'])
+    assert not cache.entries
+
+
 def test_post_list_incorrect_type(client, register_routes, computer):
     payload = {
         'data': {